@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# columns summarised per cohort, users are listed in the top n by the first one
+STAT_COLUMNS = ["total_xp", "streak"]
+PERCENTILES = np.linspace(0, 1, 101)
+TOP_N = 10
+
+class CohortStats:
+    """
+    Counts, percentile grids and top users for every group of one grouping of the leaderboard
+    """
+
+    def __init__(self, groups: np.ndarray, n_groups: int, values: dict) -> None:
+        self.n_groups = n_groups
+        self.counts = np.bincount(groups[groups >= 0], minlength=n_groups)
+        self.percentiles = {}
+        self.top_rows = None
+
+        for column, column_values in values.items():
+            valid = (groups >= 0) & ~np.isnan(column_values)
+            rows = np.flatnonzero(valid)
+
+            # sort once by (group, value) so every group is a contiguous ascending run
+            order = np.lexsort((column_values[rows], groups[rows]))
+            sorted_rows = rows[order]
+            sorted_values = column_values[sorted_rows]
+            offsets = np.searchsorted(groups[sorted_rows], np.arange(n_groups + 1))
+            counts = np.diff(offsets)
+
+            # nearest rank percentiles 0..100 of each group, nan for empty groups
+            positions = offsets[:-1, None] + np.round(PERCENTILES[None, :] * np.maximum(counts - 1, 0)[:, None]).astype(np.int64)
+            grid = sorted_values[np.minimum(positions, max(len(sorted_values) - 1, 0))] if len(sorted_values) else np.full(positions.shape, np.nan)
+            grid[counts == 0] = np.nan
+            self.percentiles[column] = grid
+
+            # the last rows of each run are the highest values, -1 pads groups with fewer than TOP_N users
+            if self.top_rows is None:
+                ranks = np.arange(TOP_N)
+                positions = offsets[1:, None] - 1 - ranks[None, :]
+                top = sorted_rows[np.clip(positions, 0, max(len(sorted_rows) - 1, 0))] if len(sorted_rows) else np.zeros(positions.shape, dtype=np.int64)
+                self.top_rows = np.where(ranks[None, :] < counts[:, None], top, -1)
+
+    def percentile_of(self, group: int, column: str, value: float) -> int | None:
+        """
+        Returns the share of the group, in percent, with a value at or below the given one
+        """
+        grid = self.percentiles[column][group]
+        if group < 0 or np.isnan(grid[0]) or np.isnan(value):
+            return None
+        return int(max(np.searchsorted(grid, value, side="right") - 1, 0))
+
+    def quantile(self, group: int, column: str, q: float) -> float:
+        return self.percentiles[column][group][int(round(q * 100))]
+
+    def top(self, group: int) -> np.ndarray:
+        rows = self.top_rows[group]
+        return rows[rows >= 0]
+
+class LeaderboardAggregates:
+    """
+    Per joining month, per league and per (joining month, league) statistics, built once per snapshot
+    """
+
+    def __init__(self, codes: dict, categories: dict, values: dict) -> None:
+        self.categories = categories
+        joining, league = codes["joining_date"], codes["current_league"]
+        self.n_leagues = len(categories["current_league"])
+
+        pairs = np.where((joining >= 0) & (league >= 0), joining.astype(np.int64) * self.n_leagues + league, -1)
+        self.groupings = {
+            "everyone": CohortStats(np.zeros(len(joining), dtype=np.int64), 1, values),
+            "joining_date": CohortStats(joining.astype(np.int64), len(categories["joining_date"]), values),
+            "current_league": CohortStats(league.astype(np.int64), self.n_leagues, values),
+            "joining_date,current_league": CohortStats(pairs, len(categories["joining_date"]) * self.n_leagues, values),
+        }
+
+    def cohort(self, joining_date=None, league=None) -> tuple:
+        """
+        Returns the grouping and group number of a cohort, the group is -1 for unknown values
+        """
+        joining = self.categories["joining_date"].get(joining_date, -1) if joining_date is not None else None
+        league_code = self.categories["current_league"].get(league, -1) if league is not None else None
+        if joining is None and league_code is None:
+            return self.groupings["everyone"], 0
+        if league_code is None:
+            return self.groupings["joining_date"], joining
+        if joining is None:
+            return self.groupings["current_league"], league_code
+        if joining < 0 or league_code < 0:
+            return self.groupings["joining_date,current_league"], -1
+        return self.groupings["joining_date,current_league"], joining * self.n_leagues + league_code
+
+    def league_distribution(self, leagues: list) -> pd.Series:
+        """
+        Returns the number of users per league in the given league order
+        """
+        counts = self.groupings["current_league"].counts
+        return pd.Series([int(counts[self.categories["current_league"][league]]) if league in self.categories["current_league"] else 0 for league in leagues], index=leagues)
+
+    def summary(self, cohorts: dict, user_values: dict = None) -> pd.DataFrame:
+        """
+        Returns one row per cohort with its size, xp and streak quantiles and the user's percentile if values are given
+        """
+        rows = []
+        for label, (joining_date, league) in cohorts.items():
+            stats, group = self.cohort(joining_date, league)
+            count = int(stats.counts[group]) if group >= 0 else 0
+            row = {"Cohort": label, "Users": count}
+            for column, title in (("total_xp", "XP"), ("streak", "Streak")):
+                if user_values is not None:
+                    percentile = stats.percentile_of(group, column, user_values[column]) if count else None
+                    row[f"Your {title} percentile"] = percentile
+                row[f"Median {title}"] = stats.quantile(group, column, 0.5) if count else None
+                row[f"Top 10% {title}"] = stats.quantile(group, column, 0.9) if count else None
+            rows.append(row)
+        return pd.DataFrame(rows).set_index("Cohort")
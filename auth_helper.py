@@ -1,27 +1,48 @@
+import os
 import time
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 
 import bcrypt
-import yaml
-from yaml.loader import SafeLoader
 from extra_streamlit_components import CookieManager
 import streamlit as st
 
 from azure_functions import *
+from user_store import *
+from session_token import *
+from login_limiter import *
+from metrics import *
 
 ONE_MONTH_IN_SECONDS = 30*24*60*60
-CONTAINER_CLIENT = get_blob_object()
+COOKIE_SESSION_KEY = "duoboard_cookie_session"
+COOKIE_MANAGER_KEY = "duoboard_cookie_manager"
 
+# seconds between checks of whether config.yaml changed
+CONFIG_TTL = float(os.environ.get("DUOBOARD_CONFIG_TTL", 30))
+
+# bcrypt runs on a few dedicated threads so a burst of logins can't take every core
+BCRYPT_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("DUOBOARD_BCRYPT_WORKERS", 2)), thread_name_prefix="bcrypt")
+
+# each username and each browser session may try LOGIN_BURST passwords at once, then one every LOGIN_REFILL seconds
+LOGIN_BURST = float(os.environ.get("DUOBOARD_LOGIN_BURST", 5))
+LOGIN_REFILL = float(os.environ.get("DUOBOARD_LOGIN_REFILL", 30))
+# seconds a failed username and password pair is rejected again without hashing
+LOGIN_FAILURE_TTL = float(os.environ.get("DUOBOARD_LOGIN_FAILURE_TTL", 300))
+LOGIN_LIMITER_SIZE = int(os.environ.get("DUOBOARD_LOGIN_LIMITER_SIZE", 10000))
+
+@timed("bcrypt_hash")
 def hash_password(password: str) -> str:
     """Hashes a plain text password."""
     # Convert the password to bytes
     password_bytes = password.encode('utf-8')
     
     # Generate a salt and hash the password
-    hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    hashed = BCRYPT_POOL.submit(bcrypt.hashpw, password_bytes, bcrypt.gensalt()).result()
     
     # Return the hashed password as a string
     return hashed.decode('utf-8')
 
+@timed("bcrypt_verify")
 def verify_password(password: str, hashed: str) -> bool:
     """Verifies a password against a stored hash."""
     # Convert both the password and the stored hash to bytes
@@ -29,136 +50,149 @@ def verify_password(password: str, hashed: str) -> bool:
     hashed_bytes = hashed.encode('utf-8')
     
     # Check if the password matches the hash
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+    return BCRYPT_POOL.submit(bcrypt.checkpw, password_bytes, hashed_bytes).result()
+
+@st.cache_resource
+def user_store() -> UserStore:
+    """
+    Process wide user store on top of config.yaml
+    """
+    return UserStore(BlobConfigBackend(get_blob_object(), "config.yaml"), ttl=CONFIG_TTL)
 
-@st.cache_data
-def read_config(coming_from:str) -> dict:
+@st.cache_resource
+def login_limiter() -> LoginLimiter:
     """
-    Reads the config.yaml file from azure
+    Process wide limiter of login attempts
     """
-    with read_csv_from_blob('config.yaml', CONTAINER_CLIENT) as file:
-        config = yaml.load(file, Loader=SafeLoader)
-    return config
+    return LoginLimiter(LOGIN_BURST, LOGIN_REFILL, LOGIN_FAILURE_TTL, LOGIN_LIMITER_SIZE)
 
-def update_config(config: dict) -> None:
+def get_login_session() -> str:
     """
-    Writes updated dictionary to config.yaml in azure
+    Returns a random id of this browser session that login attempts are counted against
     """
-    yaml_data = yaml.dump(config, default_flow_style=False, sort_keys=False)
-    write_csv_to_blob("config.yaml", yaml_data, CONTAINER_CLIENT)
+    if "login_session" not in st.session_state:
+        st.session_state["login_session"] = secrets.token_hex(16)
+    return st.session_state["login_session"]
 
-def check_input_password(username: str, password: str) -> int:
+def check_input_password(username: str, password: str, session_id: str = "") -> int:
     """
     Checks if user trying to log in is allowed or not
     """
-    config = read_config(coming_from="login")
+    user = user_store().get_user(username)
 
     # not being in config means user hasn't registered
-    if username not in config["authorized"]:
+    if user is None:
         return -1
+
+    # too many attempts for this user or session, reject without hashing
+    limiter = login_limiter()
+    if not limiter.allow(username, session_id):
+        return -2
+
+    # the same wrong password was just tried, no need to hash it again
+    if limiter.failed_before(username, user["password"], password):
+        return 0
     
     # verification returns true means all ok
-    if verify_password(password, config["authorized"][username]["password"]):
+    if verify_password(password, user["password"]):
         return 1
     
     # else incorrect password
+    limiter.record_failure(username, user["password"], password)
     return 0
 
 def check_pre_authorization(username: str) -> bool:
     """
     Checks whether user trying to register is pre-authorized to do so
     """
-    config = read_config(coming_from="register")
-    return username in config["pre-authorized"]
+    return user_store().is_pre_authorized(username)
 
 def add_user(name: str, username: str, hashed_password: str, referral: str) -> bool:
     """
     Adds provided user and details to the config file and removes from pre-authorized list
     """
     try:
-        config = read_config(coming_from="register")
-        config["authorized"][username] = dict()
-        config["authorized"][username]["name"] = name
-        config["authorized"][username]["password"] = hashed_password
-        config["authorized"][username]["referral"] = referral
-
-        config["pre-authorized"].remove(username)
-        update_config(config=config)
-        return True
+        record = {"name": name, "password": hashed_password, "referral": referral}
+        return user_store().add_user(username, record)
     except Exception as e:
         return False
 
-def get_all_cookie(id: int = 0) -> dict:
+def get_cookie_manager(read: bool = False) -> CookieManager:
+    """
+    Returns the browser session's cookie manager, mounting the cookie component again only when reading
+    """
+    # every mount of the component is a browser round trip, so writes reuse the last mounted manager
+    if read or COOKIE_MANAGER_KEY not in st.session_state:
+        st.session_state[COOKIE_MANAGER_KEY] = CookieManager(key="duoboard_cookies")
+    return st.session_state[COOKIE_MANAGER_KEY]
+
+def read_session_cookie() -> dict | None:
     """
-    Returns all the available cookies
+    Returns the validated duoboard cookie of this browser session as {"username", "expiry"}, None if there is none
     """
-    cookie_manager = CookieManager(key=f"all_cookie_{id}")
-    cookies = cookie_manager.get_all(f"all_cookie_all_{id}")
-    return cookies
+    # cookies were already read and validated earlier in this browser session
+    if COOKIE_SESSION_KEY in st.session_state:
+        return st.session_state[COOKIE_SESSION_KEY]
 
-def get_cookie(id: int = 0) -> dict:
+    cookies = get_cookie_manager(read=True).cookies
+
+    # the component has no cookies until the browser answered once, and that answer triggers a rerun
+    if not cookies and not st.session_state.get("cookie_read_pending"):
+        st.session_state["cookie_read_pending"] = True
+        return None
+
+    session = None
+    if check_cookie(cookies):
+        username, expiry = read_token(cookies["duoboard"])
+        session = {"username": username, "expiry": expiry}
+    st.session_state[COOKIE_SESSION_KEY] = session
+    return session
+
+def get_session_username() -> str | None:
     """
-    Returns specifically duoboard cookie
+    Returns the user of this browser session's cookie if it hasn't expired yet
     """
-    cookie_manager = CookieManager(key=f"get_cookie_{id}")
-    cookies = cookie_manager.get_all(key=f"get_cookie_all_{id}")
-    if "duoboard" in cookies:
-        return cookies["duoboard"]
-    return {}
+    session = read_session_cookie()
+    if session is not None and session["expiry"] >= time.time():
+        return session["username"]
+    return None
 
-def set_cookie(cookie_manager: CookieManager, username: str, password: str) -> bool:
+def set_cookie(username: str) -> bool:
     """
     Adds a duoboard cookie to the browser
     """
     try:
-        # store username, hash of password, and registering time in cookie
-        registering_time = round(time.time())
-        hashed_password = hash_password(password)
-        cookie_string = f"{username}|{hashed_password}|{registering_time}"
-        cookie_manager.set("duoboard", cookie_string, secure=False, same_site="lax")
-        return True, hashed_password
+        # store a signed token of username and expiry time in cookie
+        cookie_string = issue_token(username, ONE_MONTH_IN_SECONDS)
+        get_cookie_manager().set("duoboard", cookie_string, secure=False, same_site="lax")
+
+        # remember the new session so later reruns don't have to read the cookie back
+        username, expiry = read_token(cookie_string)
+        st.session_state[COOKIE_SESSION_KEY] = {"username": username, "expiry": expiry}
+        return True
     except Exception as e:
-        return False, None
+        return False
 
-def check_cookie(cookie:dict, id) -> bool:
+def check_cookie(cookie:dict) -> bool:
     """
     Check if passed cookie is valid
     """
     if "duoboard" not in cookie:
         return False
-    cookie = cookie["duoboard"]
-    
-    # get individual parts of the cookie
-    username, password, registered = cookie.split("|")
-
-    # convert both registration time and current time to int
-    current_time = round(time.time())
-    registered = int(registered)
-
-    # if cookie is present, that means user already logged in before so no need to check password
-    # only check if 30 days has passed
-    try:
-        if (current_time-registered) <= ONE_MONTH_IN_SECONDS:
-            return True
-    except Exception as e:
-        return False
-    return False
+    # the signature proves we issued the cookie, the expiry inside it enforces the 30 days
+    return verify_token(cookie["duoboard"]) is not None
 
 def check_if_registered(username: str) -> bool:
     """
     Check if user has already registered
     """
-    config = read_config(coming_from="register")
-    return username in config["authorized"]
+    return user_store().is_registered(username)
 
-def get_full_name(cookie: dict) -> str:
+def get_full_name(username: str) -> str:
     """
     Takes the username and returns the user's name from config
     """
-    cookie_string = cookie["duoboard"]
-    username, password, validity = cookie_string.split("|")
-    config = read_config(coming_from="login")
-    return config["authorized"][username]["name"]
+    return user_store().get_user(username)["name"]
 
 if __name__=="__main__":
     pass
@@ -1,21 +1,228 @@
 import os
+import threading
+import contextlib
+from io import BytesIO
 
-from azure.storage.blob import BlobServiceClient
-from io import StringIO
+from metrics import *
 
-def get_blob_object():
-    service = BlobServiceClient(account_url=os.environ["AZURE_BLOB_ACCOUNT_URL"], credential=os.environ["AZURE_BLOB_API_KEY"])
+# tuning for the azure client, all overridable through the environment
+BLOB_CONTAINER = os.environ.get("DUOBOARD_BLOB_CONTAINER", "duoboard")
+BLOB_RETRIES = int(os.environ.get("DUOBOARD_BLOB_RETRIES", 3))
+BLOB_CONNECT_TIMEOUT = float(os.environ.get("DUOBOARD_BLOB_CONNECT_TIMEOUT", 10))
+BLOB_READ_TIMEOUT = float(os.environ.get("DUOBOARD_BLOB_READ_TIMEOUT", 60))
+BLOB_CONCURRENCY = int(os.environ.get("DUOBOARD_BLOB_CONCURRENCY", 4))
+BLOB_POOL_SIZE = int(os.environ.get("DUOBOARD_BLOB_POOL_SIZE", 16))
+BLOB_CHUNK_SIZE = 4*1024*1024
+
+class BlobConflictError(Exception):
+    """Raised when a conditional write finds that the blob changed since it was read."""
+
+class AzureStorage:
+    """
+    Blob access through one pooled, retrying azure container client
+    """
+
+    def __init__(self, account_url: str, credential: str, container: str = BLOB_CONTAINER) -> None:
+        # the azure sdk is slow to import, so only load it once a client is actually needed
+        import requests
+        from azure.core.pipeline.transport import RequestsTransport
+        from azure.storage.blob import BlobServiceClient, ExponentialRetry
+
+        # one http session shared by every request, so connections are reused
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=BLOB_POOL_SIZE, pool_maxsize=BLOB_POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        transport = RequestsTransport(session=session, connection_timeout=BLOB_CONNECT_TIMEOUT, read_timeout=BLOB_READ_TIMEOUT)
+
+        service = BlobServiceClient(
+            account_url=account_url,
+            credential=credential,
+            transport=transport,
+            retry_policy=ExponentialRetry(initial_backoff=1, increment_base=2, retry_total=BLOB_RETRIES),
+            # blobs above one chunk are fetched as parallel ranged requests
+            max_single_get_size=BLOB_CHUNK_SIZE,
+            max_chunk_get_size=BLOB_CHUNK_SIZE,
+        )
+        self.container = service.get_container_client(container=container)
+
+    @timed("blob_download")
+    def read_with_etag(self, blob_name: str) -> tuple:
+        downloader = self.container.get_blob_client(blob=blob_name).download_blob(max_concurrency=BLOB_CONCURRENCY)
+        return downloader.readall(), downloader.properties.etag
+
+    def read_bytes(self, blob_name: str) -> bytes:
+        return self.read_with_etag(blob_name)[0]
+
+    @timed("blob_download")
+    def read_into(self, blob_name: str, stream) -> str:
+        """
+        Streams a blob into a writable file object and returns its etag
+        """
+        downloader = self.container.get_blob_client(blob=blob_name).download_blob(max_concurrency=BLOB_CONCURRENCY)
+        downloader.readinto(stream)
+        return downloader.properties.etag
+
+    def etag(self, blob_name: str) -> str:
+        return self.container.get_blob_client(blob=blob_name).get_blob_properties().etag
+
+    def last_modified(self, blob_name: str) -> float:
+        """
+        Returns when the blob was last written as a unix timestamp
+        """
+        return self.container.get_blob_client(blob=blob_name).get_blob_properties().last_modified.timestamp()
+
+    def write(self, blob_name: str, data, etag: str = None) -> str:
+        """
+        Uploads a blob, only if it is still at the given etag when one is passed
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceModifiedError
+
+        blob_client = self.container.get_blob_client(blob=blob_name)
+        conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag is not None else {}
+        try:
+            result = blob_client.upload_blob(data, overwrite=True, max_concurrency=BLOB_CONCURRENCY, **conditions)
+        except ResourceModifiedError as e:
+            raise BlobConflictError(blob_name) from e
+        return result["etag"]
+
+    def list(self, prefix: str) -> list:
+        return sorted(blob.name for blob in self.container.list_blobs(name_starts_with=prefix))
+
+    def delete(self, blob_name: str) -> None:
+        self.container.get_blob_client(blob=blob_name).delete_blob()
+
+class LocalStorage:
+    """
+    Drop-in replacement for AzureStorage that keeps blobs as files under a directory
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._lock = threading.Lock()
 
-    container = service.get_container_client(container="duoboard")
-    return container
+    def _path(self, blob_name: str) -> str:
+        return os.path.join(self.root, *blob_name.split("/"))
+
+    @staticmethod
+    def _etag_of(stat: os.stat_result) -> str:
+        # files are always replaced, never rewritten in place, so a new inode means a new version
+        return f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+    def etag(self, blob_name: str) -> str:
+        return self._etag_of(os.stat(self._path(blob_name)))
+
+    def last_modified(self, blob_name: str) -> float:
+        """
+        Returns when the blob was last written as a unix timestamp
+        """
+        return os.stat(self._path(blob_name)).st_mtime
+
+    @timed("blob_download")
+    def read_with_etag(self, blob_name: str) -> tuple:
+        with self._lock:
+            with open(self._path(blob_name), "rb") as file:
+                # the etag of the opened file, another process may replace the blob while we read it
+                return file.read(), self._etag_of(os.fstat(file.fileno()))
+
+    def read_bytes(self, blob_name: str) -> bytes:
+        return self.read_with_etag(blob_name)[0]
+
+    @timed("blob_download")
+    def read_into(self, blob_name: str, stream) -> str:
+        """
+        Streams a blob into a writable file object and returns its etag
+        """
+        with self._lock:
+            with open(self._path(blob_name), "rb") as file:
+                while chunk := file.read(BLOB_CHUNK_SIZE):
+                    stream.write(chunk)
+                return self._etag_of(os.fstat(file.fileno()))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Serialises changes across the threads of this process and the other workers sharing the directory
+        """
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, ".lock"), "w") as lock:
+                try:
+                    import fcntl
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                except ImportError:
+                    pass
+                yield
+
+    def write(self, blob_name: str, data, etag: str = None) -> str:
+        """
+        Writes a blob, only if it is still at the given etag when one is passed
+        """
+        path = self._path(blob_name)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        # the data goes to a temporary file of this process and thread first, only the check and rename are locked
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        try:
+            with self._locked():
+                if etag is not None and (not os.path.exists(path) or self.etag(blob_name) != etag):
+                    raise BlobConflictError(blob_name)
+                os.replace(tmp_path, path)
+                return self.etag(blob_name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def list(self, prefix: str) -> list:
+        names = []
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                name = os.path.relpath(os.path.join(directory, file), self.root).replace(os.sep, "/")
+                if name.startswith(prefix) and not name.endswith(".tmp") and name != ".lock":
+                    names.append(name)
+        return sorted(names)
+
+    def delete(self, blob_name: str) -> None:
+        with self._locked():
+            os.remove(self._path(blob_name))
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+def get_blob_object():
+    """
+    Returns the process wide storage, a local directory if DUOBOARD_STORAGE_DIR is set and azure otherwise
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is None:
+            if os.environ.get("DUOBOARD_STORAGE_DIR"):
+                _STORAGE = LocalStorage(os.environ["DUOBOARD_STORAGE_DIR"])
+            else:
+                _STORAGE = AzureStorage(os.environ["AZURE_BLOB_ACCOUNT_URL"], os.environ["AZURE_BLOB_API_KEY"])
+        return _STORAGE
 
 # Function to read a CSV file from Azure Blob Storage
-def read_csv_from_blob(blob_name, container) -> StringIO:
-    blob_client = container.get_blob_client(blob=blob_name)
-    downloaded_blob = blob_client.download_blob().readall()
-    return StringIO(downloaded_blob.decode('utf-8'))  # Return an in-memory file-like object
+def read_csv_from_blob(blob_name, container) -> BytesIO:
+    return BytesIO(container.read_bytes(blob_name))  # Return an in-memory file-like object without decoding
 
 # Function to write a CSV file to Azure Blob Storage
 def write_csv_to_blob(blob_name, data, container):
-    blob_client = container.get_blob_client(blob=blob_name)
-    blob_client.upload_blob(data, overwrite=True)
+    container.write(blob_name, data)
+
+# Function to get the current version of a blob without downloading it
+def get_blob_etag(blob_name, container) -> str:
+    return container.etag(blob_name)
+
+# Function to read a blob together with the version it was read at
+def read_blob_with_etag(blob_name, container) -> tuple:
+    return container.read_with_etag(blob_name)
+
+# Function to write a blob only if nobody changed it since the given etag was read
+def write_blob_if_match(blob_name, data, etag, container) -> str:
+    return container.write(blob_name, data, etag=etag)
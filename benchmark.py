@@ -0,0 +1,203 @@
+"""
+Headless benchmarks for the hot paths of duoboard, run against a generated local blob directory
+
+    python benchmark.py --rows 10000 100000 --users 10000 --output bench.jsonl
+
+Every measurement is printed as one json line so runs on different commits can be compared.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import bcrypt
+import yaml
+
+LEAGUES = ["Bronze", "Silver", "Gold", "Sapphire", "Ruby", "Emerald", "Amethyst", "Pearl", "Obsidian", "Diamond"]
+# most users sit in the lower leagues
+LEAGUE_WEIGHTS = np.array([30, 20, 15, 10, 8, 6, 4, 3, 2, 2]) / 100
+BENCH_PASSWORD = "benchpassword1"
+
+def generate_stats(rows: int, bot_share: float = 0.05, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns a synthetic STAT_FILE_TOTAL.csv table with realistic leagues, joining months and bots
+    """
+    rng = np.random.default_rng(seed)
+
+    # joining months from 2012 on, more recent months being more likely
+    months = pd.period_range("2012-01", "2025-01", freq="M").astype(str).to_numpy()
+    month_weights = np.linspace(1, 4, len(months))
+    joining = rng.choice(months, size=rows, p=month_weights / month_weights.sum())
+
+    streak = np.minimum(rng.exponential(80, rows).astype(np.int64), 4000)
+    return pd.DataFrame({
+        "name": np.char.add("User ", rng.integers(0, rows, rows).astype(str)),
+        "username": np.char.add("user", np.arange(rows).astype(str)),
+        "joining_date": joining,
+        "streak": streak,
+        "total_xp": (streak * rng.uniform(10, 60, rows)).astype(np.int64),
+        "current_league": rng.choice(LEAGUES, size=rows, p=LEAGUE_WEIGHTS),
+        "weeks_in_league": rng.integers(0, 60, rows),
+        "top_3_finish": rng.poisson(3, rows),
+        "is_bot": np.where(rng.random(rows) < bot_share, "yes", "no"),
+    })
+
+def generate_config(users: int, pre_authorized: int) -> dict:
+    """
+    Returns a synthetic config.yaml with registered users and users still waiting to register
+    """
+    # one real bcrypt hash keeps password checks at production cost without hashing every user
+    hashed = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    authorized = {f"user{i}": {"name": f"User {i}", "password": hashed, "referral": "Friend"} for i in range(users)}
+    return {"authorized": authorized, "pre-authorized": [f"newuser{i}" for i in range(pre_authorized)]}
+
+def measure(name: str, function, repeat: int, **labels) -> dict:
+    """
+    Times repeated calls of function and measures the peak python memory of one extra call
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "benchmark": name,
+        **labels,
+        "repeat": repeat,
+        "min_ms": round(min(timings) * 1000, 3),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "max_ms": round(max(timings) * 1000, 3),
+        "peak_memory_mb": round(peak / 2**20, 3),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def run(rows_list: list, users: int, repeat: int, workdir: str):
+    """
+    Generates the data, points the app at it and yields one result per benchmark
+    """
+    storage_dir = os.path.join(workdir, "storage")
+    snapshot_dir = os.path.join(workdir, "snapshot")
+    os.makedirs(os.path.join(storage_dir, "DUOLINGO_DATA"), exist_ok=True)
+
+    # the app modules read their storage location at import time
+    os.environ["DUOBOARD_STORAGE_DIR"] = storage_dir
+    os.environ["DUOBOARD_SNAPSHOT_DIR"] = snapshot_dir
+    os.environ.setdefault("DUOBOARD_SESSION_SECRET", "benchmark")
+    import snapshot
+    import auth_helper
+    from leaderboard_index import LeaderboardIndex
+    storage = auth_helper.get_blob_object()
+
+    # streamlit warns about the missing script run context on every cached call in bare mode,
+    # its first cached call loads the config that sets the log level, so quieten it afterwards
+    import streamlit.logger
+    auth_helper.user_store()
+    streamlit.logger.set_log_level("error")
+    import frontend_streamlit
+    import history
+
+    # authentication paths
+    storage.write("config.yaml", yaml.dump(generate_config(users, repeat + 1), default_flow_style=False, sort_keys=False))
+    labels = {"users": users}
+    # every attempt comes from another user and session so the login limiter doesn't kick in
+    attempts = iter(range(repeat + 1))
+    def login():
+        attempt = next(attempts) % users
+        return auth_helper.check_input_password(f"user{attempt}", BENCH_PASSWORD, f"session{attempt}")
+    yield measure("check_input_password", login, repeat, **labels)
+    yield measure("check_input_password_unknown_user", lambda: auth_helper.check_input_password("nobody", BENCH_PASSWORD), repeat, **labels)
+    # a script hammering one account with the same wrong password is rejected without hashing
+    yield measure("check_input_password_throttled", lambda: auth_helper.check_input_password("user0", "wrongpassword", "attacker"), repeat, **labels)
+
+    new_users = iter(f"newuser{i}" for i in range(repeat + 1))
+    hashed = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=4)).decode("utf-8")
+    yield measure("add_user", lambda: auth_helper.add_user("New User", next(new_users), hashed, "Friend"), repeat, **labels)
+
+    cookie = {"duoboard": auth_helper.issue_token("user1", auth_helper.ONE_MONTH_IN_SECONDS)}
+    yield measure("check_cookie", lambda: auth_helper.check_cookie(cookie), repeat, **labels)
+
+    # leaderboard paths
+    for rows in rows_list:
+        generate_stats(rows).to_csv(os.path.join(storage_dir, *snapshot.STAT_FILE.split("/")), index=False)
+        labels = {"rows": rows}
+
+        # the same calls display makes: the shared leaderboard cache, then the view and page of the page cache
+        def cold_read():
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            frontend_streamlit.leaderboard_cache.clear()
+            return frontend_streamlit.read_index()
+        def snapshot_read():
+            frontend_streamlit.leaderboard_cache.clear()
+            return frontend_streamlit.read_index()
+        yield measure("read_index_cold", cold_read, repeat, **labels)
+        yield measure("read_index_snapshot", snapshot_read, repeat, **labels)
+        yield measure("read_index_cached", frontend_streamlit.read_index, repeat, **labels)
+
+        df = snapshot.load_snapshot(snapshot.STAT_FILE, storage)
+        yield measure("build_index", lambda: LeaderboardIndex(df), repeat, **labels)
+
+        # the scheduled job that keeps the history the pages join their weekly changes from
+        yield measure("history_record", lambda: history.record_history(snapshot.STAT_FILE, storage), 1, **labels)
+
+        index = frontend_streamlit.read_index()
+        views = {
+            "page_unfiltered": ("streak", [], [], 1),
+            "page_filtered_league": ("total_xp", [], ["Gold", "Ruby"], 3),
+            "page_filtered_both": ("name", index.options("joining_date")[:12], ["Bronze"], 1),
+        }
+        for name, (sort_column, joinings, leagues, page) in views.items():
+            def view():
+                view = frontend_streamlit.LeaderboardView(index, sort_column, joinings, leagues)
+                view.total_rows()
+                return view.page(page)
+            # a first visit also locates the user, later reruns of the session remember the position
+            def cold_view():
+                frontend_streamlit.page_cache().clear()
+                frontend_streamlit.LeaderboardView(index, sort_column, joinings, leagues).position("user1")
+                return view()
+            yield measure(name, cold_view, repeat, **labels)
+            yield measure(f"{name}_cached", view, repeat, **labels)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark duoboard hot paths on synthetic data")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000], help="leaderboard sizes to generate")
+    parser.add_argument("--users", type=int, default=10_000, help="registered users in the generated config.yaml")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--output", help="also append the results to this file")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    with tempfile.TemporaryDirectory() as workdir:
+        output = open(args.output, "a") if args.output else None
+        try:
+            for result in run(args.rows, args.users, args.repeat, workdir):
+                line = json.dumps({"commit": commit, **result})
+                print(line, flush=True)
+                if output:
+                    output.write(line + "\n")
+        finally:
+            if output:
+                output.close()
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
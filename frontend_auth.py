@@ -2,14 +2,12 @@ import time
 import re
 
 import streamlit as st
-from extra_streamlit_components import CookieManager
 
-from frontend_streamlit import *
-from auth_helper import *
+# auth_helper and frontend_streamlit pull in pandas, bcrypt, yaml and the storage client,
+# they are imported inside the views that need them so the landing and FAQ pages start fast
 
 # set global configs
 st.set_page_config(layout="wide", page_title="Duoboard",menu_items={'About': "# This is a header. This is an *extremely* cool app!"},page_icon=":owl:")
-cookie_manager = CookieManager()
 VALID_PASSWORD_PATTERN = r"^[a-zA-Z0-9]+$"
 
 def register_user() -> None:
@@ -17,6 +15,8 @@ def register_user() -> None:
     Checks and registers any pre-authorized users
     """
 
+    from auth_helper import check_if_registered, check_pre_authorization, add_user, hash_password, set_cookie
+
     # Registration form
     st.title("User Registration")
 
@@ -53,15 +53,12 @@ def register_user() -> None:
         else:
             # user should be pre-authorized by admin
             if check_pre_authorization(username=username):
-                # set cookie for user for password less login
-                result, hashed_password = set_cookie(cookie_manager, username=username, password=password)
-                if result:
-                    # add the user to registered
-                    if add_user(full_name, username, hashed_password, referral):
-                        st.success(f"Registration successful! Welcome, {full_name}! Please go back to home and log in.")
-                        time.sleep(3)
-                    else:
-                        st.error("Registration failed. Please try again.")
+                # add the user to registered
+                if add_user(full_name, username, hash_password(password), referral):
+                    # set cookie for user for password less login
+                    set_cookie(username=username)
+                    st.success(f"Registration successful! Welcome, {full_name}! Please go back to home and log in.")
+                    time.sleep(3)
                 else:
                     st.error("Registration failed. Please try again.")
                 st.stop()
@@ -72,23 +69,20 @@ def login_user():
     """
     Renders a login form for already registered user
     """
+    from auth_helper import get_session_username, check_if_registered, get_full_name, check_input_password, set_cookie, get_login_session
+
     # Login form
     st.title("User Login")
-    all_cookie = {}
 
-    # if user logged in before there should be a cookie present
+    # if user logged in before there should be a valid cookie, read once per browser session
     if st.session_state["authentication_status"] is None:
-        all_cookie = get_all_cookie(st.session_state["login_count"])
-    
-    # if cookie is present
-    if all_cookie:
-        # check cookie is valid
-        if check_cookie(all_cookie, st.session_state["login_count"]):
+        username = get_session_username()
+        if username is not None and check_if_registered(username):
 
             # if valid, log user in
             st.session_state["authentication_status"] = True
-            name = get_full_name(all_cookie)
-            st.session_state["name"] = name
+            st.session_state["username"] = username
+            st.session_state["name"] = get_full_name(username)
             st.rerun()
 
     # if no cookie or invalid cookie render login form
@@ -112,31 +106,33 @@ def login_user():
             st.error("Please enter both username and password.")
         else:
             # check if user entered password is matching with saved password
-            password_check = check_input_password(username, password)
+            password_check = check_input_password(username, password, get_login_session())
 
+            # -2: too many attempts, try again later
             # -1: user not registered
             # 0 : user registered but passwords do not match
             # 1 : all ok
-            if password_check == -1:
+            if password_check == -2:
+                st.error("Too many login attempts. Please wait a minute and try again.")
+            elif password_check == -1:
                 st.error("User not registered.")
             elif password_check == 0:
                 st.error("Incorrect password.")
             else:
                 # set cookie for future passwordless login
-                result, hashed_password = set_cookie(cookie_manager, username=username, password=password)
+                result = set_cookie(username=username)
                 if result:
 
                     # log the user in
-                    all_cookie = {"duoboard":f"{username}|user_logged_in|{round(time.time())}"}
-                    name = get_full_name(all_cookie)
-                    st.session_state["name"] = name
+                    st.session_state["username"] = username
+                    st.session_state["name"] = get_full_name(username)
                     st.session_state["authentication_status"] = True
                     st.rerun()
 
 def display_cookie_policy() -> None:
     st.markdown("""# Cookie Policy\n**Effective Date:** 10th January, 2025 \n\n **This Cookie Policy explains how cookies are used in Duoboard and what information is collected during your use of the app.**\n## What are Cookies?\nCookies are small text files stored on your device to enhance your experience while using the app. They help us provide essential functionality and improve your overall experience.\n## How We Use Cookies  
 We use cookies strictly for essential purposes, such as:\n- Maintaining your login session.\n- Ensuring smooth operation of the app.\n## What Information is Stored?  
-We do not store any personal information through cookies. The only data we process includes:\n- Your Duolingo username.\n- A hashed version of your Duoboard password.\n- The time you logged in.\n\nThis information is necessary to manage your session securely and effectively.\n## Third-Party Cookies\nWe do not use any third-party cookies or tracking technologies.\n## Managing Cookies\nYou can disable cookies in your browser settings; however, please note that this may affect the functionality of the app, including your ability to stay logged in.\n## Changes to this Policy  
+We do not store any personal information through cookies. The only data we process includes:\n- Your Duolingo username.\n- A signed session token.\n- The time your session expires.\n\nThis information is necessary to manage your session securely and effectively.\n## Third-Party Cookies\nWe do not use any third-party cookies or tracking technologies.\n## Managing Cookies\nYou can disable cookies in your browser settings; however, please note that this may affect the functionality of the app, including your ability to stay logged in.\n## Changes to this Policy  
 We may update this Cookie Policy from time to time. Changes will be posted on this page, and the effective date will be updated accordingly.\n## Contact Us  
 If you have any questions or concerns about this Cookie Policy, please contact us at duoboard.help@gmail.com.\n### By using Duoboard, you consent to the use of cookies as described in this policy.
 """)
@@ -153,13 +149,12 @@ def handle_login():
     """
 
     # set some state variables if this is the dirst execution
-    if "login_count" not in st.session_state:
-        st.session_state["login_count"] = 0
+    if "authentication_status" not in st.session_state:
         st.session_state["authentication_status"] = None
-        st.cache_data.clear()
 
     # if authentication_status is True, user is logged in
     if st.session_state["authentication_status"]:
+        from frontend_streamlit import display
         name = st.session_state["name"]
         display(name)
     else:
@@ -1,21 +1,156 @@
+import os
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 
 from azure_functions import *
+from snapshot import *
+from leaderboard_index import *
+from shared_cache import *
+from shared_snapshot import *
+from page_cache import *
+from history import *
+from metrics import *
+
+# seconds between checks of whether the stats blob or its deltas changed
+DATA_TTL = float(os.environ.get("DUOBOARD_DATA_TTL", 300))
+
+# directory, ideally on tmpfs, where workers on one host share a memory mapped snapshot
+SHARED_DIR = os.environ.get("DUOBOARD_SHARED_DIR")
+
+# most recently used page slices and view sizes kept per process
+PAGE_CACHE_SIZE = int(os.environ.get("DUOBOARD_PAGE_CACHE_SIZE", 512))
+ENTRIES_PER_PAGE = 50
+
+@st.cache_resource
+def history_store() -> HistoryStore:
+    """
+    Process wide store of the daily leaderboard history
+    """
+    return HistoryStore(get_blob_object(), ttl=DATA_TTL)
+
+def load_leaderboard(version: str, previous: LeaderboardIndex = None) -> LeaderboardIndex:
+    """
+    Loads the snapshot for the given version and builds its sort and filter index
+    """
+    if SHARED_DIR:
+        # the local parquet snapshot already has the older deltas folded in, so the build stays incremental
+        return load_shared(SHARED_DIR, version, lambda: LeaderboardIndex(load_snapshot(STAT_FILE, get_blob_object())))
+
+    df = load_snapshot(STAT_FILE, get_blob_object(), previous=previous.df if previous is not None else None)
+    return LeaderboardIndex(df)
+
+@st.cache_resource
+def leaderboard_cache() -> VersionedCache:
+    """
+    Process wide leaderboard cache shared by all sessions
+    """
+    return VersionedCache(lambda: snapshot_version(STAT_FILE, get_blob_object()), load_leaderboard, ttl=DATA_TTL, incremental=True, name="leaderboard")
+
+@st.cache_resource
+def page_cache() -> PageCache:
+    """
+    Process wide cache of page slices shared by all sessions
+    """
+    return PageCache(PAGE_CACHE_SIZE)
+
+def read_index() -> LeaderboardIndex:
+    """
+    Returns the shared leaderboard index for the current snapshot
+    """
+    return leaderboard_cache().get()
 
-CONTAINER_CLIENT = get_blob_object()
+def logout_button() -> None:
+    """
+    Renders the logout button in the sidebar
+    """
+    if st.sidebar.button("Logout"):
+        st.session_state["authentication_status"] = False
+        st.rerun()
 
-@st.cache_data
-def read_data() -> pd.DataFrame:
+def display_stats(index: LeaderboardIndex, leagues: list) -> None:
+    """
+    Renders cohort statistics from the aggregates precomputed with the snapshot
+    """
+    aggregates = index.aggregates
+
+    st.title("Stats")
+    st.subheader("Users per league")
+    st.bar_chart(aggregates.league_distribution(leagues))
+
+    # compare the logged in user with the cohorts they belong to
+    row = index.row_of(st.session_state.get("username"))
+    if row is not None:
+        user = index.take([row]).iloc[0]
+        joining, league = user["joining_date"], user["current_league"]
+        cohorts = {
+            "Everyone": (None, None),
+            f"Joined {joining}": (joining, None),
+            f"{league} league": (None, league),
+            f"Joined {joining}, {league} league": (joining, league),
+        }
+        st.subheader("How you compare")
+        st.table(aggregates.summary(cohorts, {"total_xp": user["total_xp"], "streak": user["streak"]}))
+
+    # let the user look at any other cohort
+    st.subheader("Explore a cohort")
+    joining = st.selectbox("Joining month", ["All"] + index.options("joining_date"))
+    league = st.selectbox("League", ["All"] + leagues)
+    cohort = (None if joining == "All" else joining, None if league == "All" else league)
+    st.table(aggregates.summary({"Selected cohort": cohort}))
+
+    stats, group = aggregates.cohort(*cohort)
+    if group >= 0 and stats.counts[group] > 0:
+        st.write(f"Top {TOP_N} by XP")
+        st.table(index.take(stats.top(group)))
+
+class LeaderboardView:
     """
-    Read all user stats from azure and filters out all bots
+    One sorted and filtered view of the leaderboard, its pages come from the shared page cache
     """
-    with read_csv_from_blob("DUOLINGO_DATA/STAT_FILE_TOTAL.csv", CONTAINER_CLIENT) as file:
-        df = pd.read_csv(file)
-    df = df[df["is_bot"]=="no"]
-    df = df[["name","username","joining_date","streak","total_xp","current_league","weeks_in_league","top_3_finish"]]
-    return df
 
+    def __init__(self, index: LeaderboardIndex, sort_column: str, joinings: list, leagues: list) -> None:
+        self.index = index
+        self.sort_column = sort_column
+        self.filters = {"joining_date": joinings, "current_league": leagues}
+        self.key = (sort_column, tuple(sorted(joinings)), tuple(sorted(leagues)))
+        self.cache = page_cache()
+
+        # pages also show the changes since a week ago so they are cached per history baseline too
+        self.history = history_store().baseline()
+        self.version = (index.version, self.history.version if self.history is not None else None)
+        self._order = None
+
+    def order(self) -> np.ndarray:
+        """
+        Returns the filtered rows in sort order, computed at most once per view
+        """
+        if self._order is None:
+            with timer("filter_sort"):
+                self._order = self.index.order(self.sort_column, self.filters)
+        return self._order
+
+    def total_rows(self) -> int:
+        return self.cache.get(self.version, self.key, lambda: len(self.order()))
+
+    def position(self, username: str) -> int | None:
+        """
+        Returns the 0 based position of a user in this view, None if the user is not in it
+        """
+        return self.index.position(username, self.sort_column, self.order())
+
+    def page(self, page: int) -> pd.DataFrame:
+        """
+        Returns the rows of a 1 based page joined with their weekly changes
+        """
+        def build():
+            rows = self.order()[(page - 1) * ENTRIES_PER_PAGE:page * ENTRIES_PER_PAGE]
+            page_df = self.index.take(rows)
+            if self.history is not None:
+                page_df = self.history.join(page_df, self.index.ranks["total_xp"][rows])
+            return page_df
+        return self.cache.get(self.version, self.key + (page,), build)
 
 def display(name: str) -> None:
     """
@@ -23,9 +158,9 @@ def display(name: str) -> None:
     """
 
     # read the data
-    df = read_data()
+    index = read_index()
 
-    unique_joinings = df["joining_date"].unique().tolist()
+    unique_joinings = index.options("joining_date")
     unique_leagues = ["Bronze", "Silver", "Gold", "Sapphire", "Ruby", "Emerald", "Amethyst", "Pearl", "Obsidian", "Diamond"]
 
     user_to_df_column_name = {"Name":"name", "Username":"username", "Streak":"streak", "Total XP":"total_xp", "Top 3 Finish":"top_3_finish"}
@@ -33,6 +168,13 @@ def display(name: str) -> None:
 
     st.sidebar.title(f"Welcome {name}")
 
+    # choose between the leaderboard table and the cohort statistics
+    section = st.sidebar.radio("View", ["Leaderboard", "Stats"], horizontal=True)
+    if section == "Stats":
+        display_stats(index, unique_leagues)
+        logout_button()
+        return
+
     # provide user the option to customize the sort
     sortby = st.sidebar.selectbox("Sort the data by", sort_user_view, index=2)
 
@@ -40,20 +182,37 @@ def display(name: str) -> None:
     specific_joinings = st.sidebar.multiselect("Select joining months", unique_joinings, default=None)
     specific_leagues = st.sidebar.multiselect("Select league", unique_leagues, default=None)
 
-    # Apply filters to DataFrame
-    if specific_joinings:
-        df = df[df["joining_date"].isin(specific_joinings)]
-    if specific_leagues:
-        df = df[df["current_league"].isin(specific_leagues)]
-    
-    # perform the user specified sort
-    df = df.sort_values(by=user_to_df_column_name[sortby], ascending=False)
+    # popular views and pages are served from the shared cache without filtering or sorting
+    view = LeaderboardView(index, user_to_df_column_name[sortby], specific_joinings, specific_leagues)
+    total_rows = view.total_rows()
 
     # Define the number of entries per page
-    entries_per_page = 50
+    entries_per_page = ENTRIES_PER_PAGE
 
     # Calculate the total number of pages
-    total_pages = len(df) // entries_per_page + (len(df) % entries_per_page > 0)
+    total_pages = total_rows // entries_per_page + (total_rows % entries_per_page > 0)
+
+    # show the logged in user where they stand in the current sort and filters
+    username = st.session_state.get("username")
+    global_rank = index.global_rank(username, view.sort_column)
+    if global_rank is None:
+        st.sidebar.write("You are not on the leaderboard yet.")
+    else:
+        # remember the position per session so flipping pages in a filtered view doesn't redo the filter
+        key = (index.version, view.key)
+        if st.session_state.get("view_position", (None, None))[0] != key:
+            st.session_state["view_position"] = (key, view.position(username))
+        position = st.session_state["view_position"][1]
+
+        st.sidebar.write(f"Your rank: #{global_rank} overall")
+        if position is not None:
+            st.sidebar.write(f"Your rank: #{position + 1} in this view")
+            if st.sidebar.button("Go to my page"):
+                st.session_state["page"] = position // entries_per_page + 1
+
+    # keep the selected page valid when filters shrink the view
+    if st.session_state.get("page", 1) > max(total_pages, 1):
+        st.session_state["page"] = max(total_pages, 1)
 
     # Handle empty DataFrame
     if total_pages > 0:
@@ -63,7 +222,7 @@ def display(name: str) -> None:
             min_value=1,
             max_value=total_pages,
             step=1,
-            value=1
+            key="page"
         )
     else:
         # Provide a message or default behavior when the DataFrame is empty
@@ -71,20 +230,17 @@ def display(name: str) -> None:
         page = 1  # Default page value when no data is available
 
     # Button to go to a specific page (e.g., Page 6)
-    if st.sidebar.button("Logout"):
-        st.session_state["authentication_status"] = False
-        st.rerun()
-
-    # Determine the start and end indices for the current page
-    start_idx = (page - 1) * entries_per_page
-    end_idx = start_idx + entries_per_page
+    logout_button()
 
     # Slice the dataframe for the current page
-    current_page_df = df.iloc[start_idx:end_idx]
+    current_page_df = view.page(page)
 
     # Display the current page dataframe as a list
     st.title(f"Page {page} of {total_pages}")
-    st.table(current_page_df)
+    if view.history is not None:
+        st.caption(f"Weekly changes are since {view.history.date}")
+    with timer("render_table"):
+        st.table(current_page_df)
 
 if __name__=="__main__":
     pass
@@ -0,0 +1,236 @@
+import io
+import os
+import sys
+import logging
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from azure_functions import *
+from shared_cache import *
+from snapshot import *
+from leaderboard_index import *
+from metrics import *
+
+# one segment per day holds total_xp, streak and xp rank of every user, indexed by a stable integer user id
+HISTORY_PREFIX = "DUOLINGO_DATA/HISTORY/"
+USERS_BLOB = HISTORY_PREFIX + "USERS.txt"
+SEGMENT_PREFIX = HISTORY_PREFIX + "SEGMENT_"
+HISTORY_COLUMNS = ["total_xp", "streak", "rank"]
+
+# every HISTORY_KEYFRAME-th segment stores full values, the ones in between only the change since the previous one
+HISTORY_KEYFRAME = int(os.environ.get("DUOBOARD_HISTORY_KEYFRAME", 7))
+HISTORY_DAYS = 7
+
+_logger = logging.getLogger("duoboard.history")
+
+def _segment_date(name: str) -> str:
+    # names look like SEGMENT_<yyyy-mm-dd>.<key|delta>.npz, so sorting them sorts by date
+    return name[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 10]
+
+def _is_key(name: str) -> bool:
+    return name.endswith(".key.npz")
+
+def _pad(values: np.ndarray, size: int) -> np.ndarray:
+    """
+    Extends values with zeros for the user ids added since they were stored
+    """
+    padded = np.zeros(size, dtype=values.dtype)
+    padded[:len(values)] = values
+    return padded
+
+class HistoryBaseline:
+    """
+    Values of every user id at one past segment, used to compute the changes shown next to the leaderboard
+    """
+
+    def __init__(self, version: tuple, users: pd.Index, state: dict) -> None:
+        self.version = version
+        self.date = _segment_date(version[0])
+        self.users = users
+        self.state = state
+
+    def join(self, page: pd.DataFrame, xp_ranks: np.ndarray) -> pd.DataFrame:
+        """
+        Returns the page with its xp, streak and xp rank changes since the baseline, missing for users that are new since
+        """
+        size = len(self.state["present"])
+        ids = self.users.get_indexer(page["username"])
+        known = (ids >= 0) & (ids < size)
+        ids = np.where(known, ids, 0)
+        seen = known & self.state["present"][ids]
+
+        def change(values: np.ndarray) -> pd.api.extensions.ExtensionArray:
+            values = pd.array(values, dtype="Int64")
+            values[~seen] = pd.NA
+            return values
+
+        page = page.copy()
+        page["xp_this_week"] = change(page["total_xp"].to_numpy(dtype=np.int64, na_value=0) - self.state["total_xp"][ids])
+        page["streak_change"] = change(page["streak"].to_numpy(dtype=np.int64, na_value=0) - self.state["streak"][ids])
+        # positive when the user moved up
+        page["rank_change"] = change(self.state["rank"][ids] - (np.asarray(xp_ranks, dtype=np.int64) + 1))
+        return page
+
+class HistoryStore:
+    """
+    Daily, delta encoded columnar segments of the leaderboard in blob storage
+    """
+
+    def __init__(self, container, ttl: float, keyframe: int = HISTORY_KEYFRAME, days: int = HISTORY_DAYS) -> None:
+        self.container = container
+        self.keyframe = keyframe
+        self.days = days
+        self._baseline = VersionedCache(self._baseline_version, self._load_baseline, ttl=ttl, name="history")
+
+    def _segments(self) -> list:
+        return self.container.list(SEGMENT_PREFIX)
+
+    def _read_users(self) -> tuple:
+        """
+        Returns the usernames in id order and the etag of the list, None if there is no list yet
+        """
+        if not self.container.list(USERS_BLOB):
+            return [], None
+        data, etag = self.container.read_with_etag(USERS_BLOB)
+        text = data.decode("utf-8")
+        return (text.split("\n") if text else []), etag
+
+    def _assign_ids(self, usernames: pd.Series, retries: int = 5) -> tuple:
+        """
+        Returns the stable id of every username and the number of ids, appending the new usernames to the list
+        """
+        for attempt in range(retries):
+            users, etag = self._read_users()
+            ids = pd.Index(users).get_indexer(usernames)
+            new = sorted(set(usernames[ids < 0]))
+            if not new:
+                return ids, len(users)
+
+            # sorted, so processes appending from the same snapshot write the same list
+            users = users + new
+            try:
+                self.container.write(USERS_BLOB, "\n".join(users), etag=etag)
+            except BlobConflictError:
+                continue
+            return pd.Index(users).get_indexer(usernames), len(users)
+        raise BlobConflictError(USERS_BLOB)
+
+    def _read_state(self, names: list, position: int) -> dict:
+        """
+        Rebuilds the full values of the segment at position from its last keyframe and the deltas after it
+        """
+        start = position
+        while start > 0 and not _is_key(names[start]):
+            start -= 1
+
+        state = None
+        for name in names[start:position + 1]:
+            with np.load(io.BytesIO(self.container.read_bytes(name))) as segment:
+                size = int(segment["size"])
+                present = np.unpackbits(segment["present"], count=size).astype(bool)
+                if state is None or _is_key(name):
+                    state = {column: segment[column].astype(np.int64) for column in HISTORY_COLUMNS}
+                else:
+                    state = {column: _pad(state[column], size) + segment[column] for column in HISTORY_COLUMNS}
+            state["present"] = present
+        return state
+
+    def record(self, df: pd.DataFrame, xp_ranks: np.ndarray, version: str, sources: list) -> bool:
+        """
+        Stores the leaderboard of a data version as the segment of the utc date its source blobs were last written
+        """
+        date = None
+        try:
+            # dated by the data, not the clock, so a process restarting after midnight on yesterday's data
+            # doesn't pass it off as today's
+            modified = max(self.container.last_modified(name) for name in sources if name)
+            date = datetime.datetime.fromtimestamp(modified, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+            names = self._segments()
+            if names and _segment_date(names[-1]) > date:
+                return False
+            replaced = None
+            if names and _segment_date(names[-1]) == date:
+                # the date's segment is replaced by newer data of the same date, unless it already holds this version
+                with np.load(io.BytesIO(self.container.read_bytes(names[-1]))) as segment:
+                    if "version" in segment.files and str(segment["version"]) == version:
+                        return False
+                replaced, names = names[-1], names[:-1]
+
+            with timer("history_record"):
+                rows = df["username"].notna().to_numpy()
+                usernames = df["username"][rows]
+                ids, size = self._assign_ids(usernames)
+
+                present = np.zeros(size, dtype=bool)
+                present[ids] = True
+                state = {column: np.zeros(size, dtype=np.int64) for column in HISTORY_COLUMNS}
+                state["total_xp"][ids] = df["total_xp"][rows].to_numpy(dtype=np.int64, na_value=0)
+                state["streak"][ids] = df["streak"][rows].to_numpy(dtype=np.int64, na_value=0)
+                state["rank"][ids] = np.asarray(xp_ranks, dtype=np.int64)[rows] + 1
+
+                # a keyframe once no keyframe is among the last keyframe - 1 segments, a replaced segment keeps its kind
+                since_key = next((i for i, name in enumerate(reversed(names)) if _is_key(name)), len(names))
+                key = _is_key(replaced) if replaced else not names or since_key >= self.keyframe - 1
+                if key:
+                    values = state
+                else:
+                    previous = self._read_state(names, len(names) - 1)
+                    values = {column: state[column] - _pad(previous[column], size) for column in HISTORY_COLUMNS}
+
+                buffer = io.BytesIO()
+                np.savez_compressed(buffer, version=version, size=size, present=np.packbits(present), **values)
+                self.container.write(f"{SEGMENT_PREFIX}{date}.{'key' if key else 'delta'}.npz", buffer.getvalue())
+            _logger.info("Recorded history segment of %s for %d users", date, len(usernames))
+            return True
+        except Exception:
+            # the history is an extra, it must never break a leaderboard refresh
+            _logger.exception("Could not record the history segment of %s", date)
+            return False
+
+    def _baseline_version(self) -> tuple | None:
+        """
+        Returns the segment to compare with, the last one at least a week old or else the oldest, its etag and the users list etag
+        """
+        names = self._segments()
+        if not names:
+            return None
+        target = (datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=self.days)).isoformat()
+        older = [name for name in names if _segment_date(name) <= target]
+        name = older[-1] if older else names[0]
+        # the etag too, since the newest segment is replaced when more data of its date arrives
+        return name, self.container.etag(name), self.container.etag(USERS_BLOB)
+
+    def _load_baseline(self, version: tuple | None) -> HistoryBaseline | None:
+        if version is None:
+            return None
+        names = self._segments()
+        users, _ = self._read_users()
+        return HistoryBaseline(version, pd.Index(users), self._read_state(names, names.index(version[0])))
+
+    def baseline(self) -> HistoryBaseline | None:
+        """
+        Returns the cached baseline, None if there is no history yet or it can't be read
+        """
+        try:
+            return self._baseline.get()
+        except Exception:
+            _logger.exception("Could not load the history baseline")
+            return None
+
+def record_history(blob_name: str, container) -> bool:
+    """
+    Records the current leaderboard in the history, returns False if its data version is already recorded
+    """
+    df = load_snapshot(blob_name, container)
+    ranks = np.empty(len(df), dtype=np.int64)
+    ranks[descending_permutation(df["total_xp"])] = np.arange(len(df))
+    return HistoryStore(container, ttl=0).record(df, ranks, df.attrs["version"], [blob_name, df.attrs["last_delta"]])
+
+if __name__ == "__main__":
+    # run after every stats upload or periodically, e.g. from cron: python history.py record
+    if sys.argv[1:] == ["record"]:
+        recorded = record_history(STAT_FILE, get_blob_object())
+        print("Recorded a history segment" if recorded else "History is up to date")
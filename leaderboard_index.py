@@ -0,0 +1,147 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+from snapshot import *
+from aggregates import *
+
+# columns users can sort by, users filter on the categorical CATEGORY_COLUMNS of the snapshot schema
+SORT_COLUMNS = ["name", "username", "streak", "total_xp", "top_3_finish"]
+
+def descending_permutation(values: pd.Series) -> np.ndarray:
+    """
+    Returns the row positions that sort the column in descending order, missing values last
+    """
+    positions = values.reset_index(drop=True).sort_values(ascending=False, kind="stable", na_position="last")
+    return positions.index.to_numpy(dtype=np.int64)
+
+class LeaderboardIndex:
+    """
+    Sort permutations and integer encoded filter columns, built once per snapshot
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df
+        self.mapped = None
+        self.size = len(df)
+        self.version = df.attrs.get("version")
+
+        # one precomputed descending order per sortable column
+        self.permutations = {column: descending_permutation(df[column]) for column in SORT_COLUMNS}
+
+        # rank of every row per sort column, the inverse of its permutation
+        self.ranks = {}
+        for column, permutation in self.permutations.items():
+            ranks = np.empty(self.size, dtype=np.int64)
+            ranks[permutation] = np.arange(self.size)
+            self.ranks[column] = ranks
+
+        # row position of every username
+        self.rows = {username: row for row, username in enumerate(df["username"].tolist())}
+
+        # filter columns as integer codes, missing values get code -1
+        self.codes = {}
+        self.categories = {}
+        for column in CATEGORY_COLUMNS:
+            codes, uniques = pd.factorize(df[column])
+            self.codes[column] = codes.astype(np.int32)
+            self.categories[column] = {value: code for code, value in enumerate(uniques)}
+
+        # cohort statistics for the stats page
+        values = {column: df[column].to_numpy(dtype=np.float64, na_value=np.nan) for column in STAT_COLUMNS}
+        self.aggregates = LeaderboardAggregates(self.codes, self.categories, values)
+
+    @classmethod
+    def from_arrays(cls, mapped, permutations: dict, ranks: dict, codes: dict, categories: dict, aggregates, version: str) -> "LeaderboardIndex":
+        """
+        Rebuilds an index from precomputed arrays over a table that only materialises the rows asked for
+        """
+        index = cls.__new__(cls)
+        index.df = None
+        index.mapped = mapped
+        index.size = len(mapped)
+        index.version = version
+        index.permutations = permutations
+        index.ranks = ranks
+        index.rows = None
+        index.codes = codes
+        index.categories = categories
+        index.aggregates = aggregates
+        return index
+
+    def row_of(self, username: str) -> int | None:
+        """
+        Returns the row position of a username, None if the user is not on the leaderboard
+        """
+        if self.rows is not None:
+            return self.rows.get(username)
+        return self.mapped.row_of(username)
+
+    def options(self, column: str) -> list:
+        """
+        Returns the distinct values of a filter column in order of appearance
+        """
+        return list(self.categories[column])
+
+    def mask(self, filters: dict) -> np.ndarray | None:
+        """
+        Returns a boolean row mask for the selected values of each filter column, None if nothing is selected
+        """
+        mask = None
+        for column, selected in filters.items():
+            if not selected:
+                continue
+
+            # extra trailing slot so that code -1 (missing value) never matches
+            lookup = np.zeros(len(self.categories[column]) + 1, dtype=bool)
+            for value in selected:
+                code = self.categories[column].get(value)
+                if code is not None:
+                    lookup[code] = True
+
+            column_mask = lookup[self.codes[column]]
+            mask = column_mask if mask is None else mask & column_mask
+        return mask
+
+    def order(self, sort_column: str, filters: dict) -> np.ndarray:
+        """
+        Returns the row positions of the filtered view in sorted order
+        """
+        permutation = self.permutations[sort_column]
+        mask = self.mask(filters)
+        if mask is None:
+            return permutation
+        return permutation[mask[permutation]]
+
+    def global_rank(self, username: str, sort_column: str) -> int | None:
+        """
+        Returns the 1 based rank of a user over the whole leaderboard, None if the user is not on it
+        """
+        row = self.row_of(username)
+        if row is None:
+            return None
+        return int(self.ranks[sort_column][row]) + 1
+
+    def position(self, username: str, sort_column: str, order: np.ndarray) -> int | None:
+        """
+        Returns the 0 based position of a user within a sorted view from order, None if the user is not in it
+        """
+        row = self.row_of(username)
+        if row is None:
+            return None
+
+        # the ranks along any view of a permutation are increasing, so binary search them
+        ranks = self.ranks[sort_column]
+        position = bisect.bisect_left(order, ranks[row], key=ranks.__getitem__)
+        if position < len(order) and order[position] == row:
+            return position
+        return None
+
+    def take(self, rows: np.ndarray) -> pd.DataFrame:
+        """
+        Returns the given row positions as a dataframe
+        """
+        if self.mapped is not None:
+            return self.mapped.take(rows)
+        return self.df.iloc[rows]
@@ -0,0 +1,99 @@
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+
+from metrics import *
+
+class TokenBuckets:
+    """
+    Token bucket per key, the least recently used keys are forgotten beyond max_entries
+    """
+
+    def __init__(self, burst: float, refill_seconds: float, max_entries: int) -> None:
+        # a key may spend burst attempts at once, then regains one every refill_seconds
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+
+    def take(self, key, now: float) -> bool:
+        """
+        Spends one token of key, False if its bucket is empty
+        """
+        stored = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, stored[0] + (now - stored[1]) / self.refill_seconds)
+        allowed = tokens >= 1
+        # a rejected attempt keeps the stored state, adding up fractions of a token would delay the refill by rounding
+        self._buckets[key] = (tokens - 1, now) if allowed else stored
+
+        # a forgotten key starts with a full bucket again, which only costs a few extra attempts
+        while len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+        return allowed
+
+class LoginLimiter:
+    """
+    Rejects excess or already failed login attempts before any bcrypt work
+    """
+
+    def __init__(self, burst: float, refill_seconds: float, failure_ttl: float, max_entries: int) -> None:
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users = TokenBuckets(burst, refill_seconds, max_entries)
+        self._sessions = TokenBuckets(burst, refill_seconds, max_entries)
+
+        # keyed digest -> expiry of recently failed attempts, plaintext passwords are never kept
+        self._failures = OrderedDict()
+        self._key = secrets.token_bytes(32)
+
+    def _digest(self, username: str, stored_hash: str, password: str) -> bytes:
+        # the stored hash is part of the key so a changed password isn't rejected with the old one's failures
+        message = "\0".join((username, stored_hash, password)).encode("utf-8")
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def allow(self, username: str, session_id: str) -> bool:
+        """
+        Spends one attempt of the username and of the session, False if either has none left
+        """
+        now = time.monotonic()
+        with self._lock:
+            # both buckets are charged so a throttled session can't save up attempts for another user
+            user_allowed = self._users.take(username, now)
+            session_allowed = self._sessions.take(session_id, now)
+        if user_allowed and session_allowed:
+            return True
+        count("throttled", "login")
+        count("hash_avoided", "login")
+        return False
+
+    def failed_before(self, username: str, stored_hash: str, password: str) -> bool:
+        """
+        Checks whether the same username and password failed within the last failure_ttl seconds
+        """
+        digest = self._digest(username, stored_hash, password)
+        now = time.monotonic()
+        with self._lock:
+            expiry = self._failures.get(digest)
+            if expiry is None:
+                return False
+            if expiry < now:
+                del self._failures[digest]
+                return False
+        count("failure_cache_hit", "login")
+        count("hash_avoided", "login")
+        return True
+
+    def record_failure(self, username: str, stored_hash: str, password: str) -> None:
+        """
+        Remembers a failed attempt so repeating it doesn't hash again
+        """
+        digest = self._digest(username, stored_hash, password)
+        with self._lock:
+            self._failures.pop(digest, None)
+            self._failures[digest] = time.monotonic() + self.failure_ttl
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
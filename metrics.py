@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import functools
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# everything here is a no-op unless DUOBOARD_METRICS is set
+METRICS_ENABLED = os.environ.get("DUOBOARD_METRICS", "").lower() not in ("", "0", "false", "no")
+
+# where to publish: a prometheus text file ({pid} is replaced per worker), an http port, or else log lines
+METRICS_FILE = os.environ.get("DUOBOARD_METRICS_FILE")
+METRICS_PORT = os.environ.get("DUOBOARD_METRICS_PORT")
+METRICS_INTERVAL = float(os.environ.get("DUOBOARD_METRICS_INTERVAL", 30))
+
+# latency histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_logger = logging.getLogger("duoboard.metrics")
+
+_lock = threading.Lock()
+# stage -> [count per bucket..., count above the last bucket, sum of seconds]
+_histograms = {}
+# (name, stage) -> value
+_counters = {}
+_gauges = {}
+_last_publish = time.monotonic()
+_NULL_TIMER = contextlib.nullcontext()
+
+def observe(stage: str, seconds: float) -> None:
+    """
+    Records one latency of a stage
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.setdefault(stage, [0] * (len(BUCKETS) + 2))
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+    _maybe_publish()
+
+def count(name: str, stage: str, value: int = 1) -> None:
+    """
+    Adds to a counter of a stage, e.g. count("cache_hit", "leaderboard")
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _counters[(name, stage)] = _counters.get((name, stage), 0) + value
+
+def gauge(name: str, stage: str, value: float) -> None:
+    """
+    Sets a gauge of a stage to its latest value, e.g. gauge("memory_bytes", "leaderboard", size)
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _gauges[(name, stage)] = value
+
+class _Timer:
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        observe(self.stage, time.perf_counter() - self.start)
+
+def timer(stage: str):
+    """
+    Context manager timing the enclosed block as one observation of a stage
+    """
+    return _Timer(stage) if METRICS_ENABLED else _NULL_TIMER
+
+def timed(stage: str):
+    """
+    Decorator timing every call of a function as an observation of a stage
+    """
+    def decorator(function):
+        # disabled metrics leave the function untouched
+        if not METRICS_ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def render_prometheus() -> str:
+    """
+    Returns all metrics in the prometheus text exposition format
+    """
+    with _lock:
+        histograms = {stage: list(values) for stage, values in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = ["# TYPE duoboard_stage_seconds histogram"]
+    for stage, values in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, values):
+            cumulative += bucket
+            lines.append(f'duoboard_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        total = cumulative + values[len(BUCKETS)]
+        lines.append(f'duoboard_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {total}')
+        lines.append(f'duoboard_stage_seconds_sum{{stage="{stage}"}} {values[-1]:.6f}')
+        lines.append(f'duoboard_stage_seconds_count{{stage="{stage}"}} {total}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE duoboard_{name}_total counter")
+        for (counter, stage), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f'duoboard_{name}_total{{stage="{stage}"}} {value}')
+
+    for name in sorted({name for name, _ in gauges}):
+        lines.append(f"# TYPE duoboard_{name} gauge")
+        for (gauge_name, stage), value in sorted(gauges.items()):
+            if gauge_name == name:
+                lines.append(f'duoboard_{name}{{stage="{stage}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def summary() -> dict:
+    """
+    Returns counts, mean latencies and counters per stage for structured logging
+    """
+    with _lock:
+        stages = {stage: {"count": sum(values[:-1]), "mean_ms": round(values[-1] / max(sum(values[:-1]), 1) * 1000, 3)} for stage, values in _histograms.items()}
+        for (name, stage), value in list(_counters.items()) + list(_gauges.items()):
+            stages.setdefault(stage, {})[name] = value
+    return stages
+
+def publish() -> None:
+    """
+    Writes the metrics file or a log line, whichever is configured
+    """
+    if METRICS_FILE:
+        path = METRICS_FILE.format(pid=os.getpid())
+        try:
+            # one temporary file per thread, two threads may publish at once
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as file:
+                file.write(render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError:
+            _logger.exception("Could not write metrics to %s", path)
+    elif not METRICS_PORT:
+        _logger.info(json.dumps({"metrics": summary(), "pid": os.getpid()}))
+
+def _maybe_publish() -> None:
+    """
+    Publishes at most once per interval, from whichever thread records a metric
+    """
+    global _last_publish
+    now = time.monotonic()
+    if now - _last_publish < METRICS_INTERVAL:
+        return
+    _last_publish = now
+    publish()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+def _serve() -> None:
+    """
+    Serves /metrics on DUOBOARD_METRICS_PORT from a daemon thread
+    """
+    try:
+        server = ThreadingHTTPServer(("", int(METRICS_PORT)), _MetricsHandler)
+    except OSError:
+        # another worker on this host already serves the port
+        _logger.warning("Metrics port %s is in use", METRICS_PORT)
+        return
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+if METRICS_ENABLED and METRICS_PORT:
+    _serve()
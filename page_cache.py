@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+from metrics import *
+
+class PageCache:
+    """
+    Bounded LRU of values derived from one snapshot version, such as the rendered page slices
+    """
+
+    def __init__(self, max_entries: int, name: str = "pages") -> None:
+        self.max_entries = max_entries
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, key, build):
+        """
+        Returns the value cached for key under version, calling build() on a miss
+        """
+        with self._lock:
+            if version != self._version:
+                # the snapshot changed, so every cached page is stale
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._record(hit=True)
+                return self._entries[key]
+            self._record(hit=False)
+
+        # build outside the lock, two sessions missing the same page at once just both build it
+        value = build()
+
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        count("cache_hit" if hit else "cache_miss", self.name)
+        gauge("hit_rate", self.name, self.hit_rate())
+
+    def hit_rate(self) -> float:
+        """
+        Returns the share of lookups served from the cache since startup
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
@@ -0,0 +1,56 @@
+import os
+import hmac
+import time
+import hashlib
+import logging
+import secrets
+
+_logger = logging.getLogger("duoboard.session")
+
+# all workers must share the secret, otherwise tokens only validate in the process that issued them
+SESSION_SECRET = os.environ.get("DUOBOARD_SESSION_SECRET", "").encode("utf-8")
+if not SESSION_SECRET:
+    SESSION_SECRET = secrets.token_hex(32).encode("utf-8")
+    _logger.warning(
+        "DUOBOARD_SESSION_SECRET is not set, using a random secret for this process only: "
+        "every restart logs all users out and cookies issued by other workers are rejected"
+    )
+
+def _sign(payload: str) -> str:
+    """
+    Returns the hex HMAC-SHA256 signature of a token payload
+    """
+    return hmac.new(SESSION_SECRET, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def issue_token(username: str, ttl: int) -> str:
+    """
+    Returns a signed username|expiry|signature token valid for ttl seconds
+    """
+    expiry = round(time.time()) + ttl
+    payload = f"{username}|{expiry}"
+    return f"{payload}|{_sign(payload)}"
+
+def read_token(token: str) -> tuple | None:
+    """
+    Returns (username, expiry) of a valid, unexpired token and None otherwise
+    """
+    try:
+        username, expiry, signature = token.rsplit("|", 2)
+        expiry = int(expiry)
+    except (AttributeError, ValueError):
+        return None
+
+    # constant time compare so the signature can't be guessed byte by byte, as bytes since
+    # compare_digest refuses str with non-ascii characters and the token comes from the browser
+    if not hmac.compare_digest(signature.encode("utf-8"), _sign(f"{username}|{expiry}").encode("utf-8")):
+        return None
+    if expiry < time.time():
+        return None
+    return username, expiry
+
+def verify_token(token: str) -> str | None:
+    """
+    Returns the username of a valid, unexpired token and None otherwise
+    """
+    session = read_token(token)
+    return session[0] if session is not None else None
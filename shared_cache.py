@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+
+from metrics import *
+
+_logger = logging.getLogger("duoboard.cache")
+
+class VersionedCache:
+    """
+    Process wide holder of one immutable value that is only reloaded when its source version changes
+    """
+
+    def __init__(self, get_version, load, ttl: float, incremental: bool = False, name: str = "cache") -> None:
+        # get_version() returns the current source version, load(version) builds the value for it
+        # with incremental, load(version, previous) also gets the old value to update from
+        self.name = name
+        self._get_version = get_version
+        self._load = load
+        self.ttl = ttl
+        self.incremental = incremental
+        self._lock = threading.Lock()
+
+        # (version, value, time of last version check), swapped as a whole so readers never see a mix
+        self._entry = None
+
+    def _fresh(self):
+        """
+        Returns the cached entry if its version was checked within the ttl
+        """
+        entry = self._entry
+        if entry is not None and time.monotonic() - entry[2] < self.ttl:
+            return entry
+        return None
+
+    def get(self):
+        """
+        Returns the cached value, checking the source version at most once per ttl
+        """
+        entry = self._fresh()
+        if entry is not None:
+            count("cache_hit", self.name)
+            return entry[1]
+
+        # only one session checks and reloads, the others wait and reuse its result
+        with self._lock:
+            entry = self._fresh()
+            if entry is not None:
+                count("cache_hit", self.name)
+                return entry[1]
+
+            try:
+                version = self._get_version()
+            except Exception:
+                # keep serving the old value if the source can't be reached, retry after the ttl
+                if self._entry is None:
+                    raise
+                _logger.exception("Could not check the version of %s", self.name)
+                self._entry = (self._entry[0], self._entry[1], time.monotonic())
+                return self._entry[1]
+
+            if self._entry is not None and self._entry[0] == version:
+                count("cache_hit", self.name)
+                value = self._entry[1]
+            else:
+                count("cache_miss", self.name)
+                try:
+                    with timer(f"{self.name}_load"):
+                        if self.incremental:
+                            value = self._load(version, self._entry[1] if self._entry is not None else None)
+                        else:
+                            value = self._load(version)
+                except Exception:
+                    # a broken source keeps the old value in service, the load is retried after the ttl
+                    if self._entry is None:
+                        raise
+                    _logger.exception("Could not load %s version %s, serving version %s", self.name, version, self._entry[0])
+                    count("load_error", self.name)
+                    self._entry = (self._entry[0], self._entry[1], time.monotonic())
+                    return self._entry[1]
+            self._entry = (version, value, time.monotonic())
+            return value
+
+    def version(self):
+        """
+        Returns the version of the cached value, None if nothing is loaded yet
+        """
+        entry = self._entry
+        return entry[0] if entry is not None else None
+
+    def set(self, version, value) -> None:
+        """
+        Replaces the cached value with one the caller just wrote to the source
+        """
+        with self._lock:
+            self._entry = (version, value, time.monotonic())
+
+    def invalidate(self) -> None:
+        """
+        Forces a version check on the next get
+        """
+        with self._lock:
+            if self._entry is not None:
+                self._entry = (self._entry[0], self._entry[1], float("-inf"))
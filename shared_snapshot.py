@@ -0,0 +1,202 @@
+import os
+import json
+import shutil
+import pickle
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from leaderboard_index import *
+
+# columns stored as utf-8 bytes plus offsets, the category columns are stored once as index codes
+STRING_COLUMNS = ["name", "username"]
+KEEP_VERSIONS = 2
+
+def _version_dir(root: str, version: str) -> str:
+    return os.path.join(root, hashlib.sha1(version.encode("utf-8")).hexdigest()[:16])
+
+def _plain(value):
+    """
+    Returns a json serialisable python value for a numpy scalar
+    """
+    return value.item() if hasattr(value, "item") else value
+
+class MappedFrame:
+    """
+    Read-only leaderboard columns memory mapped from .npy files, rows are only decoded when taken
+    """
+
+    def __init__(self, path: str, meta: dict) -> None:
+        self.columns = meta["columns"]
+        self.size = meta["size"]
+        self.attrs = meta["attrs"]
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        self.arrays = {}
+        for column in self.columns:
+            if column in STRING_COLUMNS:
+                self.arrays[column] = tuple(np.load(os.path.join(path, f"{column}.{part}.npy"), mmap_mode="r") for part in ("bytes", "offsets", "missing"))
+            elif column in meta["categories"]:
+                self.arrays[column] = (np.load(os.path.join(path, f"codes.{column}.npy"), mmap_mode="r"), np.array(meta["categories"][column] + [np.nan], dtype=object))
+            else:
+                self.arrays[column] = np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+
+        # usernames in ascending order, for binary search instead of a per process dict
+        self.username_order = np.load(os.path.join(path, "username_order.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _string(self, column: str, row: int):
+        data, offsets, missing = self.arrays[column]
+        if missing[row]:
+            return np.nan
+        return data[offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def take(self, rows) -> pd.DataFrame:
+        rows = np.asarray(rows, dtype=np.int64)
+        data = {}
+        for column in self.columns:
+            if column in STRING_COLUMNS:
+                data[column] = [self._string(column, row) for row in rows]
+            elif isinstance(self.arrays[column], tuple):
+                # code -1 picks the trailing nan
+                codes, categories = self.arrays[column]
+                data[column] = categories[codes[rows]]
+            else:
+                data[column] = np.asarray(self.arrays[column][rows])
+        return pd.DataFrame(data, index=np.asarray(self.labels[rows]))
+
+    def row_of(self, username: str) -> int | None:
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            value = self._string("username", int(self.username_order[middle]))
+            # missing usernames are sorted last
+            if isinstance(value, str) and value < username:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.size and self._string("username", int(self.username_order[low])) == username:
+            return int(self.username_order[low])
+        return None
+
+def publish_index(root: str, index: LeaderboardIndex) -> None:
+    """
+    Writes an index and its dataframe as .npy files and atomically publishes them under its version
+    """
+    df = index.df
+    path = _version_dir(root, index.version)
+    staging = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    def save(name: str, array: np.ndarray) -> None:
+        np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(array))
+
+    save("labels", df.index.to_numpy(dtype=np.int64))
+    for column in df.columns:
+        if column in STRING_COLUMNS:
+            missing = df[column].isna().to_numpy()
+            encoded = [value.encode("utf-8") if not is_missing else b"" for value, is_missing in zip(df[column].astype(str).tolist(), missing)]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            save(f"{column}.bytes", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            save(f"{column}.offsets", offsets)
+            save(f"{column}.missing", missing)
+        elif column not in index.codes:
+            save(column, df[column].to_numpy())
+
+    for column, codes in index.codes.items():
+        save(f"codes.{column}", codes)
+    for column in index.permutations:
+        save(f"permutation.{column}", index.permutations[column])
+        save(f"rank.{column}", index.ranks[column])
+    username_order = df["username"].reset_index(drop=True).sort_values(kind="stable", na_position="last").index
+    save("username_order", username_order.to_numpy(dtype=np.int64))
+
+    # the aggregates are small, every worker simply unpickles them
+    with open(os.path.join(staging, "aggregates.pkl"), "wb") as file:
+        pickle.dump(index.aggregates, file)
+
+    meta = {
+        "version": index.version,
+        "size": index.size,
+        "columns": list(df.columns),
+        "categories": {column: [_plain(value) for value in categories] for column, categories in index.categories.items()},
+        "attrs": {key: str(value) for key, value in df.attrs.items()},
+    }
+    with open(os.path.join(staging, "meta.json"), "w") as file:
+        json.dump(meta, file)
+
+    # the finished directory is renamed into place, so readers only ever see complete versions
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    _cleanup(root, os.path.basename(path))
+
+def _cleanup(root: str, current: str) -> None:
+    """
+    Removes all but the newest versions, workers still mapping them keep their open files
+    """
+    versions = [name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)) and ".tmp" not in name]
+    versions.sort(key=lambda name: os.path.getmtime(os.path.join(root, name)), reverse=True)
+    for name in versions[KEEP_VERSIONS:]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def attach(root: str, version: str) -> LeaderboardIndex | None:
+    """
+    Maps the published index of the given version read-only, None if that version isn't published
+    """
+    path = _version_dir(root, version)
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    # another worker's cleanup may remove the version while we map it, that counts as not published
+    try:
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta["version"] != version:
+            return None
+
+        categories = {column: {value: code for code, value in enumerate(values)} for column, values in meta["categories"].items()}
+        codes = {column: load(f"codes.{column}") for column in categories}
+        permutations = {column: load(f"permutation.{column}") for column in SORT_COLUMNS}
+        ranks = {column: load(f"rank.{column}") for column in SORT_COLUMNS}
+        with open(os.path.join(path, "aggregates.pkl"), "rb") as file:
+            aggregates = pickle.load(file)
+        return LeaderboardIndex.from_arrays(MappedFrame(path, meta), permutations, ranks, codes, categories, aggregates, version)
+    except OSError:
+        return None
+
+def load_shared(root: str, version: str, build) -> LeaderboardIndex:
+    """
+    Returns the mapped index of a version, building and publishing it with build() if no other worker did yet
+    """
+    index = attach(root, version)
+    if index is not None:
+        return index
+
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        # one worker per host parses, the others wait here and then map its result
+        try:
+            import fcntl
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+
+        index = attach(root, version)
+        if index is None:
+            # build() loads whatever is current, which may be newer than the version asked for and
+            # already published, so never replace a directory other workers may have mapped
+            built = build()
+            index = attach(root, built.version)
+            if index is None:
+                publish_index(root, built)
+                index = attach(root, built.version)
+            if index is None:
+                # cleaned up right away by a worker publishing an even newer version
+                index = built
+    return index
@@ -0,0 +1,253 @@
+import os
+import sys
+import logging
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from azure_functions import *
+from metrics import *
+
+# local directory holding the columnar copies of the leaderboard
+SNAPSHOT_DIR = os.environ.get("DUOBOARD_SNAPSHOT_DIR", ".duoboard_snapshot")
+STAT_FILE = "DUOLINGO_DATA/STAT_FILE_TOTAL.csv"
+LEADERBOARD_COLUMNS = ["name","username","joining_date","streak","total_xp","current_league","weeks_in_league","top_3_finish"]
+
+# columns read as text, low cardinality ones become categoricals, all others are parsed as numbers and downcast
+TEXT_COLUMNS = ["name", "username"]
+CATEGORY_COLUMNS = ["joining_date", "current_league"]
+CSV_DTYPES = {"name": str, "username": str, "joining_date": str, "current_league": str, "is_bot": str}
+CSV_CHUNK_ROWS = 200_000
+
+logger = logging.getLogger("duoboard.snapshot")
+
+# small csvs with only the changed rows, named so that sorting them gives the order they were written in
+DELTA_PREFIX = "DUOLINGO_DATA/STAT_DELTA_"
+
+def _snapshot_path(blob_name: str) -> str:
+    """
+    Returns the local parquet path used for a blob
+    """
+    return os.path.join(SNAPSHOT_DIR, f"{os.path.splitext(os.path.basename(blob_name))[0]}.parquet")
+
+def _read_local_snapshot(blob_name: str, etag: str) -> pd.DataFrame | None:
+    """
+    Returns the local snapshot if it was built from the given blob etag, None otherwise
+    """
+    try:
+        with timer("snapshot_read"):
+            df = pd.read_parquet(_snapshot_path(blob_name))
+    except Exception:
+        # missing or corrupted snapshots are rebuilt by the caller
+        return None
+    # the base etag and the last delta folded in travel inside the parquet as df.attrs
+    if df.attrs.get("base") != etag or "last_delta" not in df.attrs:
+        return None
+    return df
+
+def _write_snapshot(df: pd.DataFrame, blob_name: str) -> None:
+    """
+    Atomically replaces the local snapshot together with the versions it was built from
+    """
+    path = _snapshot_path(blob_name)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+        # every worker writes its own temporary file, so a concurrent reader or writer never sees half a file
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        # snapshot is only an optimisation, a read-only disk should not break the app
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Stores low cardinality columns as categoricals and numbers in the smallest dtype that holds them
+    """
+    for column in CATEGORY_COLUMNS:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    for column in df.columns.difference(TEXT_COLUMNS + CATEGORY_COLUMNS):
+        # columns with missing values stay float64, float32 would round large xp totals
+        if not df[column].isna().any():
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+def read_rows(file, chunksize: int = None):
+    """
+    Reads only the leaderboard columns and is_bot of a stats csv, in chunks if chunksize is given
+    """
+    columns = set(LEADERBOARD_COLUMNS + ["is_bot"])
+    return pd.read_csv(file, usecols=lambda column: column in columns, dtype=CSV_DTYPES, chunksize=chunksize)
+
+def report_memory(df: pd.DataFrame) -> None:
+    """
+    Logs and records how much memory the leaderboard takes
+    """
+    size = int(df.memory_usage(deep=True).sum())
+    gauge("memory_bytes", "leaderboard", size)
+    logger.info("Leaderboard snapshot has %d rows in %.1f MB", len(df), size / 2**20)
+
+@timed("csv_parse")
+def parse_leaderboard(file) -> pd.DataFrame:
+    """
+    Parses the raw stats csv and drops bots and unused columns
+    """
+    # bots are dropped chunk by chunk so the full raw table is never held at once
+    chunks = []
+    for chunk in read_rows(file, chunksize=CSV_CHUNK_ROWS):
+        chunk = chunk[chunk["is_bot"]=="no"]
+        chunk = chunk[LEADERBOARD_COLUMNS]
+        for column in CATEGORY_COLUMNS:
+            chunk[column] = chunk[column].astype("category")
+        chunks.append(chunk)
+
+    df = pd.concat([chunk.drop(columns=CATEGORY_COLUMNS) for chunk in chunks])
+    # categories differ between chunks, union them instead of letting concat fall back to strings
+    for column in CATEGORY_COLUMNS:
+        values = union_categoricals([chunk[column] for chunk in chunks]) if chunks else pd.Categorical([])
+        df.insert(LEADERBOARD_COLUMNS.index(column), column, values)
+    return apply_schema(df)
+
+def upsert(df: pd.DataFrame, changes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces or appends the rows of changes keyed by username, changed rows keep their index label
+    """
+    # a delta of only bot removals leaves nothing to merge
+    if changes.empty:
+        return df
+
+    # a user can show up in several deltas, only the latest row counts
+    changes = changes.drop_duplicates(subset="username", keep="last")
+
+    # look up the labels of users already present and hand out fresh ones to new users
+    existing = pd.Series(df.index, index=df["username"].to_numpy())
+    existing = existing[~existing.index.duplicated(keep="last")]
+    labels = existing.reindex(changes["username"].to_numpy()).to_numpy(dtype=np.float64)
+    new = np.isnan(labels)
+    start = df.index.max() + 1 if len(df) else 0
+    labels[new] = np.arange(start, start + new.sum())
+    changes = changes.set_axis(labels.astype(np.int64))
+
+    kept = df[~df["username"].isin(changes["username"])]
+    return pd.concat([kept, changes[df.columns]])
+
+def combine_deltas(df: pd.DataFrame, deltas: list, columns: list) -> pd.DataFrame:
+    """
+    Returns the latest delta row per username with the given columns, is_bot defaults to no and the other columns
+    a delta leaves out keep the user's current value, or stay empty for users new to the leaderboard
+    """
+    changes = None
+    current = None
+    for delta in deltas:
+        if "is_bot" not in delta:
+            delta = delta.assign(is_bot="no")
+        delta = delta.drop_duplicates(subset="username", keep="last")
+
+        missing = [column for column in columns if column not in delta]
+        if missing:
+            # earlier deltas are newer than the leaderboard itself
+            if current is None:
+                current = df.drop_duplicates(subset="username", keep="last").set_index("username")
+            latest = current[missing]
+            if changes is not None:
+                latest = pd.concat([latest, changes.set_index("username")[missing]])
+                latest = latest[~latest.index.duplicated(keep="last")]
+            delta = delta.join(latest, on="username")
+
+        delta = delta[columns]
+        changes = delta if changes is None else pd.concat([changes, delta]).drop_duplicates(subset="username", keep="last")
+    return changes
+
+@timed("delta_merge")
+def apply_deltas(df: pd.DataFrame, deltas: list) -> pd.DataFrame:
+    """
+    Merges parsed delta csvs into the leaderboard, a delta row marked as bot removes the user
+    """
+    changes = combine_deltas(df, deltas, LEADERBOARD_COLUMNS + ["is_bot"])
+
+    bots = changes["is_bot"] != "no"
+    df = df[~df["username"].isin(changes.loc[bots, "username"])]
+    upserts = changes.loc[~bots, LEADERBOARD_COLUMNS]
+    # removals alone keep the schema, only merged rows have to be retyped
+    merged = apply_schema(upsert(df, upserts)) if len(upserts) else df.copy()
+    merged.attrs = dict(df.attrs)
+    return merged
+
+def snapshot_version(blob_name: str, container) -> str:
+    """
+    Returns the version of the leaderboard, the base blob etag plus the newest delta
+    """
+    deltas = container.list(DELTA_PREFIX)
+    return f"{get_blob_etag(blob_name, container)}|{deltas[-1] if deltas else ''}"
+
+def load_snapshot(blob_name: str, container, previous: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Returns the leaderboard with all deltas applied, reusing the previous or the local snapshot when the base blob is unchanged
+    """
+    etag = get_blob_etag(blob_name, container)
+    deltas = container.list(DELTA_PREFIX)
+
+    # an unchanged base only needs the deltas that arrived since
+    df = None
+    if previous is not None and previous.attrs.get("base") == etag:
+        df = previous
+    if df is None:
+        df = _read_local_snapshot(blob_name, etag)
+    if df is None:
+        # stream the csv to a temporary file so the whole download is never held in memory next to the parsed table
+        with tempfile.TemporaryFile() as file:
+            etag = container.read_into(blob_name, file)
+            file.seek(0)
+            df = parse_leaderboard(file)
+        df.attrs["base"] = etag
+        df.attrs["last_delta"] = ""
+        _write_snapshot(df, blob_name)
+
+    pending = [name for name in deltas if name > df.attrs["last_delta"]]
+    if pending:
+        parsed = []
+        for name in pending:
+            with read_csv_from_blob(name, container) as file:
+                parsed.append(read_rows(file))
+        df = apply_deltas(df, parsed)
+        df.attrs["last_delta"] = pending[-1]
+        _write_snapshot(df, blob_name)
+
+    report_memory(df)
+
+    # keep track of which source version this data came from
+    df.attrs["version"] = f"{etag}|{df.attrs['last_delta']}"
+    return df
+
+def compact_deltas(blob_name: str, container) -> int:
+    """
+    Folds all deltas into the full stats csv and deletes them, returns how many were folded
+    """
+    deltas = container.list(DELTA_PREFIX)
+    if not deltas:
+        return 0
+
+    # work on the raw rows so bots and every column survive in the compacted file
+    data, etag = read_blob_with_etag(blob_name, container)
+    full = pd.read_csv(BytesIO(data))
+    changes = combine_deltas(full, [pd.read_csv(read_csv_from_blob(name, container)) for name in deltas], list(full.columns))
+    # the merged rows turn integer columns with gaps into floats, write them back as integers
+    full = upsert(full, changes).convert_dtypes()
+
+    # fails if the full file was replaced meanwhile, the deltas are then left for the next run
+    write_blob_if_match(blob_name, full.to_csv(index=False), etag, container)
+    for name in deltas:
+        container.delete(name)
+    return len(deltas)
+
+if __name__ == "__main__":
+    # run periodically, e.g. from cron: python snapshot.py compact
+    if sys.argv[1:] == ["compact"]:
+        print(f"Folded {compact_deltas(STAT_FILE, get_blob_object())} deltas into {STAT_FILE}")
@@ -0,0 +1,103 @@
+import os
+import sys
+import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure_functions import *
+from history import *
+
+def leaderboard(users: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "username": [f"user{i}" for i in range(users)],
+        "total_xp": rng.integers(0, 10000, users),
+        "streak": rng.integers(0, 100, users),
+    })
+
+def write_source(storage: LocalStorage, date: str, version: str) -> None:
+    storage.write("stats.csv", version)
+    timestamp = datetime.datetime.fromisoformat(date).replace(hour=12, tzinfo=datetime.timezone.utc).timestamp()
+    os.utime(storage._path("stats.csv"), (timestamp, timestamp))
+
+def record(store: HistoryStore, storage: LocalStorage, df: pd.DataFrame, date: str, version: str) -> bool:
+    write_source(storage, date, version)
+    ranks = np.empty(len(df), dtype=np.int64)
+    ranks[np.argsort(-df["total_xp"].to_numpy(), kind="stable")] = np.arange(len(df))
+    return store.record(df, ranks, version, ["stats.csv", ""])
+
+def test_keyframes_and_deltas_round_trip(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    store = HistoryStore(storage, ttl=0, keyframe=3)
+    df = leaderboard(50, 0)
+    rng = np.random.default_rng(1)
+    expected = []
+    for day in range(8):
+        # xp grows, some users leave and new ones join
+        df = df.copy()
+        df["total_xp"] += rng.integers(0, 500, len(df))
+        df["streak"] = rng.integers(0, 100, len(df))
+        joined = pd.DataFrame({"username": [f"new{day}_{i}" for i in range(3)], "total_xp": [1, 2, 3], "streak": [0, 1, 2]})
+        df = pd.concat([df.iloc[2:], joined], ignore_index=True)
+        assert record(store, storage, df, f"2026-10-{day + 1:02d}", f"v{day}")
+        expected.append(df.set_index("username"))
+
+    names = store._segments()
+    assert [name.rsplit(".", 2)[1] for name in names] == ["key", "delta", "delta", "key", "delta", "delta", "key", "delta"]
+
+    users, _ = store._read_users()
+    for position, df in enumerate(expected):
+        state = store._read_state(names, position)
+        present = np.flatnonzero(state["present"])
+        assert sorted(users[i] for i in present) == sorted(df.index)
+        ids = pd.Index(users).get_indexer(df.index)
+        assert (state["total_xp"][ids] == df["total_xp"].to_numpy()).all()
+        assert (state["streak"][ids] == df["streak"].to_numpy()).all()
+
+def test_segments_follow_the_data_version(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    store = HistoryStore(storage, ttl=0)
+    df = leaderboard(10, 0)
+    assert record(store, storage, df, "2026-10-01", "v1")
+
+    # a restart on the next day still sees the data of the first day
+    assert not record(store, storage, df, "2026-10-01", "v1")
+    assert len(store._segments()) == 1
+
+    # newer data of the same day replaces its segment
+    df["total_xp"] += 10
+    assert record(store, storage, df, "2026-10-01", "v2")
+    names = store._segments()
+    assert len(names) == 1
+    assert (store._read_state(names, 0)["total_xp"][:10] == df["total_xp"].to_numpy()).all()
+
+    assert record(store, storage, df, "2026-10-02", "v3")
+    assert len(store._segments()) == 2
+
+def test_baseline_join(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    store = HistoryStore(storage, ttl=0)
+    old = leaderboard(10, 0)
+    assert record(store, storage, old, "2026-10-01", "v1")
+
+    new = pd.concat([old, pd.DataFrame({"username": ["late"], "total_xp": [5], "streak": [1]})], ignore_index=True)
+    new["total_xp"] += 100
+    page = store.baseline().join(new, np.arange(len(new)))
+    assert (page["xp_this_week"][:10] == 100).all()
+    assert page["xp_this_week"].isna().iloc[10]
+
+def test_record_history_job(tmp_path, monkeypatch):
+    import snapshot
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+    storage = LocalStorage(str(tmp_path / "storage"))
+    df = leaderboard(20, 0).assign(name="x", joining_date="2020-01", current_league="Gold", weeks_in_league=1, top_3_finish=0, is_bot="no")
+    storage.write(STAT_FILE, df.to_csv(index=False))
+
+    assert record_history(STAT_FILE, storage)
+    # nothing new to record until the data changes
+    assert not record_history(STAT_FILE, storage)
+    users, _ = HistoryStore(storage, ttl=0)._read_users()
+    assert sorted(users) == sorted(df["username"])
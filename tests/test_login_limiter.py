@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import login_limiter
+from login_limiter import *
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(login_limiter.time, "monotonic", clock)
+    return clock
+
+def test_bucket_burst_then_refill():
+    buckets = TokenBuckets(burst=3, refill_seconds=10, max_entries=10)
+    assert [buckets.take("ann", 0) for _ in range(4)] == [True, True, True, False]
+    # less than one refill later there is still nothing to spend
+    assert not buckets.take("ann", 9)
+    assert buckets.take("ann", 19)
+    assert not buckets.take("ann", 19)
+    # a long pause refills at most the burst
+    assert [buckets.take("ann", 1000) for _ in range(4)] == [True, True, True, False]
+
+def test_rejected_attempts_dont_delay_the_refill():
+    buckets = TokenBuckets(burst=1, refill_seconds=10, max_entries=10)
+    assert buckets.take("ann", 0)
+    for second in range(1, 10):
+        assert not buckets.take("ann", second)
+    assert buckets.take("ann", 10)
+
+def test_buckets_evict_the_least_recently_used():
+    buckets = TokenBuckets(burst=1, refill_seconds=100, max_entries=2)
+    assert buckets.take("ann", 0)
+    assert buckets.take("bob", 0)
+    assert not buckets.take("ann", 0)
+    # cat pushes out bob, the least recently used, who then starts with a full bucket
+    assert buckets.take("cat", 0)
+    assert len(buckets._buckets) == 2
+    assert buckets.take("bob", 0)
+    assert "ann" not in buckets._buckets
+
+def test_limiter_charges_user_and_session(clock):
+    limiter = LoginLimiter(burst=2, refill_seconds=60, failure_ttl=300, max_entries=100)
+    assert limiter.allow("ann", "s1")
+    assert limiter.allow("ann", "s2")
+    # ann is out of attempts whichever session asks
+    assert not limiter.allow("ann", "s3")
+    # s1 has one attempt left for another user, then it is throttled too
+    assert limiter.allow("bob", "s1")
+    assert not limiter.allow("cat", "s1")
+    clock.now += 60
+    assert limiter.allow("ann", "s4")
+
+def test_failure_cache_expires(clock):
+    limiter = LoginLimiter(burst=5, refill_seconds=60, failure_ttl=300, max_entries=100)
+    limiter.record_failure("ann", "hash", "wrong")
+    assert limiter.failed_before("ann", "hash", "wrong")
+    assert not limiter.failed_before("ann", "hash", "other")
+    assert not limiter.failed_before("bob", "hash", "wrong")
+    # a new stored hash means a changed password, the old failures don't apply
+    assert not limiter.failed_before("ann", "newhash", "wrong")
+    clock.now += 299
+    assert limiter.failed_before("ann", "hash", "wrong")
+    clock.now += 2
+    assert not limiter.failed_before("ann", "hash", "wrong")
+    assert len(limiter._failures) == 0
+
+def test_failure_cache_is_bounded_and_keeps_no_passwords(clock):
+    limiter = LoginLimiter(burst=5, refill_seconds=60, failure_ttl=300, max_entries=3)
+    for attempt in range(5):
+        limiter.record_failure("ann", "hash", f"secret{attempt}")
+    assert len(limiter._failures) == 3
+    assert not limiter.failed_before("ann", "hash", "secret0")
+    assert limiter.failed_before("ann", "hash", "secret4")
+    assert all(b"secret" not in digest for digest in limiter._failures)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_token import *
+
+def test_round_trip():
+    token = issue_token("bob", 60)
+    assert verify_token(token) == "bob"
+    assert read_token(token)[0] == "bob"
+
+def test_usernames_with_separators_and_unicode():
+    for username in ["a|b", "zoë", ""]:
+        assert verify_token(issue_token(username, 60)) == username
+
+def test_malformed_tokens():
+    for token in [None, 42, "", "bob", "bob|123", "bob|notanumber|abc", "|||"]:
+        assert read_token(token) is None
+
+def test_tampered_tokens():
+    username, expiry, signature = issue_token("bob", 60).rsplit("|", 2)
+    assert read_token(f"alice|{expiry}|{signature}") is None
+    assert read_token(f"{username}|{int(expiry) + 1}|{signature}") is None
+    flipped = "1" if signature[-1] == "0" else "0"
+    assert read_token(f"{username}|{expiry}|{signature[:-1]}{flipped}") is None
+    # non-ascii signatures must be rejected, not raise
+    assert read_token("bob|99999999999|é") is None
+    assert read_token(f"{username}|{expiry}|{signature[:-1]}é") is None
+
+def test_expired_token():
+    assert read_token(issue_token("bob", -10)) is None
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_cache import *
+
+class Source:
+    def __init__(self) -> None:
+        self.version = 1
+        self.loads = 0
+        self.broken = False
+
+    def load(self, version):
+        self.loads += 1
+        if self.broken:
+            raise ValueError("bad blob")
+        return f"value {version}"
+
+def test_reloads_only_when_the_version_changes():
+    source = Source()
+    cache = VersionedCache(lambda: source.version, source.load, ttl=0)
+    assert cache.get() == "value 1"
+    assert cache.get() == "value 1"
+    assert source.loads == 1
+    source.version = 2
+    assert cache.get() == "value 2"
+    assert source.loads == 2
+
+def test_failed_load_serves_the_old_value_until_the_ttl():
+    source = Source()
+    cache = VersionedCache(lambda: source.version, source.load, ttl=60)
+    assert cache.get() == "value 1"
+
+    source.version, source.broken = 2, True
+    cache.invalidate()
+    for _ in range(3):
+        assert cache.get() == "value 1"
+    # one attempt, then the old value is served without retrying until the ttl passed
+    assert source.loads == 2
+    assert cache.version() == 1
+
+    source.broken = False
+    cache.invalidate()
+    assert cache.get() == "value 2"
+
+def test_failed_first_load_raises():
+    source = Source()
+    source.broken = True
+    cache = VersionedCache(lambda: source.version, source.load, ttl=60)
+    with pytest.raises(ValueError):
+        cache.get()
+
+def test_unreachable_version_serves_the_old_value():
+    source = Source()
+    def version():
+        if source.broken:
+            raise OSError("unreachable")
+        return source.version
+    cache = VersionedCache(version, source.load, ttl=60)
+    assert cache.get() == "value 1"
+    source.broken = True
+    cache.invalidate()
+    assert cache.get() == "value 1"
@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import warnings
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snapshot import *
+
+def stats(rows: list) -> pd.DataFrame:
+    columns = LEADERBOARD_COLUMNS + ["is_bot"]
+    return pd.DataFrame([dict(zip(columns, row)) for row in rows], columns=columns)
+
+FULL = stats([
+    ["Ann", "ann", "2020-01", 10, 1000, "Gold", 3, 1, "no"],
+    ["Bob", "bob", "2021-05", 5, 500, "Silver", 1, 0, "no"],
+    ["Cat", "cat", "2020-01", 0, 50, "Bronze", 0, 0, "no"],
+])
+
+def parse(df: pd.DataFrame) -> pd.DataFrame:
+    return read_rows(io.StringIO(df.to_csv(index=False)))
+
+@pytest.fixture
+def leaderboard():
+    return parse_leaderboard(io.StringIO(FULL.to_csv(index=False)))
+
+@pytest.fixture(autouse=True)
+def no_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        yield
+
+def test_upsert_replaces_and_appends(leaderboard):
+    changes = stats([["Bob", "bob", "2021-05", 6, 600, "Gold", 2, 1, "no"], ["Dan", "dan", "2024-02", 1, 10, "Bronze", 0, 0, "no"]])
+    merged = upsert(leaderboard, changes[LEADERBOARD_COLUMNS])
+    assert merged.loc[1, "total_xp"] == 600
+    assert merged.set_index("username").loc["dan", "total_xp"] == 10
+    assert merged.index.is_unique and len(merged) == 4
+
+def test_upsert_without_changes(leaderboard):
+    assert upsert(leaderboard, leaderboard.iloc[:0]) is leaderboard
+
+def test_bot_removal(leaderboard):
+    merged = apply_deltas(leaderboard, [parse(stats([["Bob", "bob", "2021-05", 5, 500, "Silver", 1, 0, "yes"]]))])
+    assert list(merged["username"]) == ["ann", "cat"]
+    assert isinstance(merged["current_league"].dtype, pd.CategoricalDtype)
+
+def test_new_user_with_new_categories(leaderboard):
+    delta = stats([["Eve", "eve", "2025-01", 3, 300, "Diamond", 1, 0, "no"]])
+    merged = apply_deltas(leaderboard, [parse(delta)]).set_index("username")
+    assert merged.loc["eve", "current_league"] == "Diamond"
+    assert merged.loc["eve", "joining_date"] == "2025-01"
+    assert "Diamond" in merged["current_league"].cat.categories
+    assert merged.loc["ann", "current_league"] == "Gold"
+
+def test_partial_delta_keeps_other_columns(leaderboard):
+    first = pd.DataFrame({"username": ["ann"], "streak": [11]})
+    second = pd.DataFrame({"username": ["ann", "fay"], "total_xp": [1100, 70]})
+    merged = apply_deltas(leaderboard, [first, second]).set_index("username")
+    assert merged.loc["ann", "total_xp"] == 1100
+    assert merged.loc["ann", "streak"] == 11
+    assert merged.loc["ann", "current_league"] == "Gold"
+    assert merged.loc["fay", "total_xp"] == 70
+    assert pd.isna(merged.loc["fay", "current_league"])
+
+def test_compact_deltas(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.write(STAT_FILE, FULL.to_csv(index=False))
+    storage.write(DELTA_PREFIX + "1.csv", pd.DataFrame({"username": ["ann", "gus"], "total_xp": [2000, 5]}).to_csv(index=False))
+    storage.write(DELTA_PREFIX + "2.csv", stats([["Bob", "bob", "2021-05", 5, 500, "Silver", 1, 0, "yes"], ["Hal", "hal", "2025-02", 2, 20, "Pearl", 0, 0, "no"]]).to_csv(index=False))
+
+    assert compact_deltas(STAT_FILE, storage) == 2
+    assert storage.list(DELTA_PREFIX) == []
+    full = pd.read_csv(io.BytesIO(storage.read_bytes(STAT_FILE))).set_index("username")
+    assert full.loc["ann", "total_xp"] == 2000
+    assert full.loc["ann", "name"] == "Ann" and full.loc["ann", "streak"] == 10
+    assert full.loc["bob", "is_bot"] == "yes"
+    assert full.loc["gus", "is_bot"] == "no" and pd.isna(full.loc["gus", "name"])
+    assert full.loc["hal", "current_league"] == "Pearl"
+    # integer columns stay integers despite the gaps of gus
+    assert "." not in storage.read_bytes(STAT_FILE).decode().splitlines()[1]
@@ -0,0 +1,46 @@
+import os
+import sys
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure_functions import *
+
+def append_lines(root: str, worker: int, lines: int) -> None:
+    storage = LocalStorage(root)
+    for line in range(lines):
+        # read, append and write back only if nobody wrote in between, like the user list of the history
+        while True:
+            data, etag = storage.read_with_etag("list.txt")
+            try:
+                storage.write("list.txt", data + f"{worker}-{line}\n".encode(), etag=etag)
+                break
+            except BlobConflictError:
+                continue
+
+def test_conditional_write(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    etag = storage.write("a/b.txt", "one")
+    assert storage.read_bytes("a/b.txt") == b"one"
+    with pytest.raises(BlobConflictError):
+        storage.write("a/b.txt", "two", etag="stale")
+    with pytest.raises(BlobConflictError):
+        storage.write("a/missing.txt", "two", etag=etag)
+    storage.write("a/b.txt", "two", etag=etag)
+    assert storage.read_bytes("a/b.txt") == b"two"
+    assert storage.list("") == ["a/b.txt"]
+
+def test_conditional_writes_across_processes(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.write("list.txt", "")
+    workers = [multiprocessing.Process(target=append_lines, args=(str(tmp_path), worker, 25)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    lines = storage.read_bytes("list.txt").decode().split()
+    assert sorted(lines) == sorted(f"{worker}-{line}" for worker in range(4) for line in range(25))
+    assert storage.list("") == ["list.txt"]
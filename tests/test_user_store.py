@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_store import *
+
+class MemoryBackend:
+    """
+    config.yaml kept in memory, versioned like a blob and counting reads and writes
+    """
+
+    def __init__(self, config: dict) -> None:
+        self.data = yaml.dump(config)
+        self.etag = 1
+        self.reads = 0
+        self.writes = 0
+        self.before_write = None
+        self.lock = threading.Lock()
+
+    def version(self) -> str:
+        return str(self.etag)
+
+    def read(self) -> tuple:
+        self.reads += 1
+        return self.data, str(self.etag)
+
+    def write(self, data: str, version: str = None) -> str:
+        if self.before_write is not None:
+            hook, self.before_write = self.before_write, None
+            hook()
+        with self.lock:
+            if version is not None and version != str(self.etag):
+                raise BlobConflictError("config.yaml")
+            self.data = data
+            self.etag += 1
+            self.writes += 1
+            return str(self.etag)
+
+    def config(self) -> dict:
+        return yaml.safe_load(self.data)
+
+def record(name: str) -> dict:
+    return {"name": name, "password": "hash", "referral": "Friend"}
+
+def store_with(pre_authorized: list, authorized: dict = None) -> tuple:
+    backend = MemoryBackend({"authorized": authorized or {}, "pre-authorized": pre_authorized})
+    return UserStore(backend, ttl=60), backend
+
+def test_add_user_updates_the_cache_without_reading_back():
+    store, backend = store_with(["ann", "bob"])
+    assert store.add_user("ann", record("Ann"))
+    assert backend.config()["authorized"] == {"ann": record("Ann")}
+    assert backend.config()["pre-authorized"] == ["bob"]
+    assert store.is_registered("ann") and not store.is_pre_authorized("ann")
+    assert backend.reads == 1
+
+def test_only_pre_authorized_users_register_once():
+    store, backend = store_with(["ann"], {"bob": record("Bob")})
+    assert not store.add_user("bob", record("Bob"))
+    assert not store.add_user("cat", record("Cat"))
+    assert store.add_user("ann", record("Ann"))
+    assert not store.add_user("ann", record("Ann"))
+    assert backend.writes == 1
+
+def test_conflict_retries_on_the_new_version():
+    store, backend = store_with(["ann", "bob"])
+    store.table()
+
+    # another process registers bob right before our write
+    def other_worker():
+        config = backend.config()
+        config["authorized"]["bob"] = record("Bob")
+        config["pre-authorized"] = ["ann"]
+        backend.data = yaml.dump(config)
+        backend.etag += 1
+    backend.before_write = other_worker
+
+    assert store.add_user("ann", record("Ann"))
+    config = backend.config()
+    assert set(config["authorized"]) == {"ann", "bob"}
+    assert config["pre-authorized"] == []
+    assert store.is_registered("bob")
+
+def test_gives_up_after_the_retries():
+    store, backend = store_with(["ann"])
+    store.retries = 2
+    backend.write = lambda data, version=None: (_ for _ in ()).throw(BlobConflictError("config.yaml"))
+    assert not store.add_user("ann", record("Ann"))
+
+def test_concurrent_registrations_are_batched():
+    users = [f"user{i}" for i in range(20)]
+    store, backend = store_with(users)
+    store.table()
+
+    # hold the write lock so every registration queues up behind the first one
+    store._write_lock.acquire()
+    results = {}
+    threads = [threading.Thread(target=lambda user=user: results.__setitem__(user, store.add_user(user, record(user)))) for user in users]
+    for thread in threads:
+        thread.start()
+    while len(store._pending) < len(users):
+        pass
+    store._write_lock.release()
+    for thread in threads:
+        thread.join()
+
+    assert all(results.values())
+    assert set(backend.config()["authorized"]) == set(users)
+    assert backend.writes == 1
@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+
+import yaml
+
+from azure_functions import *
+from shared_cache import *
+from metrics import *
+
+# the libyaml bindings parse and dump config.yaml several times faster than the pure python ones
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+class BlobConfigBackend:
+    """
+    Keeps config.yaml in blob storage, azure or a local directory
+    """
+
+    def __init__(self, container, blob_name: str = "config.yaml") -> None:
+        self.container = container
+        self.blob_name = blob_name
+
+    def version(self) -> str:
+        return get_blob_etag(self.blob_name, self.container)
+
+    def read(self) -> tuple:
+        return read_blob_with_etag(self.blob_name, self.container)
+
+    def write(self, data: str, version: str = None) -> str:
+        """
+        Writes the config, only if it is still at the given version when one is passed
+        """
+        return self.container.write(self.blob_name, data, etag=version)
+
+class UserTable:
+    """
+    One parsed version of config.yaml with hashed lookups
+    """
+
+    def __init__(self, config: dict, version: str) -> None:
+        self.config = config
+        self.version = version
+        self.authorized = config["authorized"] or {}
+        self.pre_authorized = frozenset(config["pre-authorized"] or [])
+
+class UserStore:
+    """
+    Per user lookups and conditional, batched writes on top of config.yaml
+    """
+
+    def __init__(self, backend, ttl: float, retries: int = 5) -> None:
+        self.backend = backend
+        self.retries = retries
+        self._cache = VersionedCache(backend.version, self._load, ttl=ttl, name="config")
+
+        # registrations waiting to be written, flushed together by whichever session holds the write lock
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _load(self, version: str) -> UserTable:
+        data, version = self.backend.read()
+        with timer("config_parse"):
+            return UserTable(yaml.load(data, Loader=YAML_LOADER), version)
+
+    def table(self) -> UserTable:
+        return self._cache.get()
+
+    def get_user(self, username: str) -> dict | None:
+        return self.table().authorized.get(username)
+
+    def is_registered(self, username: str) -> bool:
+        return username in self.table().authorized
+
+    def is_pre_authorized(self, username: str) -> bool:
+        return username in self.table().pre_authorized
+
+    def add_user(self, username: str, record: dict) -> bool:
+        """
+        Registers a pre-authorized user, returns False if the user can't be added
+        """
+        request = {"username": username, "record": record, "done": False, "result": False}
+        with self._pending_lock:
+            self._pending.append(request)
+
+        with self._write_lock:
+            # another session may already have written our registration as part of its batch
+            if not request["done"]:
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                try:
+                    self._commit(batch)
+                finally:
+                    for pending in batch:
+                        pending["done"] = True
+        return request["result"]
+
+    def _commit(self, batch: list) -> None:
+        """
+        Applies a batch of registrations with one conditional write, retrying on conflicts
+        """
+        # start from the cached table, the conditional write tells us if it was stale
+        table = self.table()
+        for attempt in range(self.retries):
+            # the cached config is shared with every reader, so copy what we change
+            config = dict(table.config)
+            config["authorized"] = dict(table.authorized)
+            pre_authorized = set(table.pre_authorized)
+
+            added = set()
+            for request in batch:
+                username = request["username"]
+                request["result"] = username in pre_authorized and username not in config["authorized"]
+                if request["result"]:
+                    config["authorized"][username] = request["record"]
+                    pre_authorized.discard(username)
+                    added.add(username)
+
+            if not added:
+                return
+
+            # single pass over the list instead of one remove per user
+            config["pre-authorized"] = [username for username in config["pre-authorized"] or [] if username not in added]
+            try:
+                version = self.backend.write(yaml.dump(config, Dumper=YAML_DUMPER, default_flow_style=False, sort_keys=False), table.version)
+            except BlobConflictError:
+                # somebody else wrote in between, back off and redo the batch on the new version
+                time.sleep(random.uniform(0, 0.1 * 2**attempt))
+                table = self._load(None)
+                self._cache.set(table.version, table)
+                continue
+
+            # we know exactly what is stored now, so lookups don't have to read it back
+            self._cache.set(version, UserTable(config, version))
+            return
+
+        for request in batch:
+            request["result"] = False